@@ -0,0 +1,5 @@
+from .api import solve_position
+from .parallel import SearchPool
+from .solve import DealResult, GameResult
+
+__all__ = ['solve_position', 'SearchPool', 'DealResult', 'GameResult']
@@ -0,0 +1,64 @@
+import random
+from typing import Optional, Union
+
+from .cache import SolutionCache, open_cache
+from .card import Shuffler
+from .notation import read_position
+from .parallel import SearchPool
+from .solve import GameResult, solve_game
+from .transposition import DEFAULT_SIZE, TranspositionTable
+
+
+def solve_position(position, redeal: bool = False, max_deal: int = 3, merci: bool = False,
+                   deal: int = 1, seed=None, pool: Optional[SearchPool] = None,
+                   table_size: int = DEFAULT_SIZE, split_depth: int = 2,
+                   time_limit: Optional[float] = None, max_nodes: Optional[int] = None,
+                   por: bool = True, stats: bool = False,
+                   cache: Union[SolutionCache, str, None] = None,
+                   handle_interrupt: bool = False) -> GameResult:
+    """
+    Solve a game of La Belle Lucie from /position/ and return a GameResult,
+    without printing anything.
+
+    /position/ is the tableau, given as text (fans on separate lines or
+    separated by '/', like "KH 2S 8S / 3S 5S QH / ...", or the compact
+    form starting with '='), as a list of fans
+    (each a list of cards like "KH", or a string of them), or as a Tableau;
+    the foundation holds every card that isn't on it. ValueError is raised
+    if it isn't a valid position.
+
+    The game starts on deal /deal/. If /redeal/ is set and that deal
+    doesn't win, the remaining cards are shuffled and redealt, up to
+    /max_deal/. If /seed/ is given, the shuffles are those of a
+    card.Shuffler for game 0 of /seed/, as `lbl batch` and `lbl simulate`
+    make with --seed, so they're repeatable; otherwise they're random. If
+    /merci/ is set, one merci is allowed on the final deal.
+
+    By default the search runs in this process with its own transposition
+    table of /table_size/ positions. To share worker processes between
+    calls, pass a SearchPool as /pool/; its workers' tables are then used,
+    and the tree is split at /split_depth/ blocking moves.
+
+    /time_limit/ (seconds per deal) and /max_nodes/ (legal permutations
+    per deal) stop the search early with the best line found so far; /por/
+    and /stats/ are as for solve_deal(). Each deal's moves, final tableau
+    and foundation, and timings are in the result's /deals/.
+
+    /cache/ is a SolutionCache, or the path of one to open (and keep open
+    for later calls), to look deals up in before searching them.
+
+    Ctrl-C is left to the calling program, raising KeyboardInterrupt as
+    usual, unless /handle_interrupt/ is set: then it stops the search of
+    the current deal, and the result is marked as interrupted.
+    """
+    tableau, found = read_position(position)
+    if isinstance(cache, str):
+        cache = open_cache(cache)
+    options = {'time_limit': time_limit, 'max_nodes': max_nodes, 'por': por, 'stats': stats,
+               'cache': cache, 'handle_interrupt': handle_interrupt}
+    if pool is not None:
+        options.update(pool=pool, split_depth=split_depth)
+    elif table_size > 0:
+        options.update(table=TranspositionTable(table_size))
+    rng = Shuffler(seed, 0) if seed is not None else random.Random()
+    return solve_game(tableau, found, deal, max_deal, redeal, merci, rng, **options)
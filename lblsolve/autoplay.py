@@ -0,0 +1,267 @@
+import random
+import sys
+from collections import Counter
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from .card import CARDS
+from .instrument import Stopwatch
+from .lucie import Fan, Foundations, Tableau
+from .simulate import cards_left_histogram, game_rng
+from .solve import run_automatic_actions
+
+NUM_FANS = 18
+# Marks a slot with no card in DealBatch.cards, and an empty fan's top card.
+NO_CARD = 52
+
+# What each deal of a DealBatch is doing during run_automatic_actions().
+PLAYING, BUILDING, DONE = range(3)
+
+
+class DealBatch:
+    """
+    Many positions at once, held in NumPy arrays so the automatic moves
+    (see solve.run_automatic_actions()) can be made on all of them together:
+
+    /cards/ holds the card ids of each fan from bottom to top, shaped
+    (deals, fans, slots), with NO_CARD in the slots above the top card;
+    /lengths/ holds the number of cards in each fan, shaped (deals, fans);
+    /heights/ holds the height of each foundation pile (in the order of
+    SUITS), shaped (deals, 4).
+
+    Fans that become empty stay where they are, with a length of 0, rather
+    than being torn down: the fans around them keep their order, which is
+    all the rules depend on.
+    """
+    def __init__(self, cards: np.ndarray, lengths: np.ndarray, heights: np.ndarray) -> None:
+        self.cards = cards
+        self.lengths = lengths
+        self.heights = heights
+        self.foundation_moves = np.zeros(len(cards), dtype=np.int32)
+        self.safe_builds = np.zeros(len(cards), dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.cards)
+
+    @classmethod
+    def deal(cls, seed, first: int, count: int) -> 'DealBatch':
+        """
+        Deal games number /first/ to /first/ + /count/ - 1 of a simulation
+        seeded with /seed/: the same deals as `lbl simulate` plays.
+        """
+        ids = np.empty((count, len(CARDS)), dtype=np.int8)
+        order = list(range(len(CARDS)))
+        for row in range(count):
+            # The same shuffle as deal_game(), without the cards.
+            shuffled = order[:]
+            game_rng(seed, first + row).shuffle(shuffled)
+            ids[row] = shuffled
+        # Cards are dealt three to a fan, with one left for the last fan.
+        cards = np.full((count, NUM_FANS, 3 + 12), NO_CARD, dtype=np.int8)
+        cards[:, :NUM_FANS - 1, :3] = ids[:, :51].reshape(count, NUM_FANS - 1, 3)
+        cards[:, NUM_FANS - 1, 0] = ids[:, 51]
+        lengths = np.full((count, NUM_FANS), 3, dtype=np.int8)
+        lengths[:, NUM_FANS - 1] = 1
+        return cls(cards, lengths, np.zeros((count, 4), dtype=np.int8))
+
+    @classmethod
+    def from_positions(cls,
+                       positions: Sequence[Tuple[Tableau, Foundations]]) -> 'DealBatch':
+        "Copy a list of tableaus and foundations into a new DealBatch."
+        num_fans = max(len(tableau.fans) for tableau, _ in positions)
+        # A fan can grow by at most a whole suit's worth of cards.
+        slots = max(len(fan) for tableau, _ in positions for fan in tableau.fans) + 12
+        cards = np.full((len(positions), num_fans, slots), NO_CARD, dtype=np.int8)
+        lengths = np.zeros((len(positions), num_fans), dtype=np.int8)
+        heights = np.zeros((len(positions), 4), dtype=np.int8)
+        for row, (tableau, found) in enumerate(positions):
+            for col, fan in enumerate(tableau.fans):
+                cards[row, col, :len(fan)] = [c.id for c in fan]
+                lengths[row, col] = len(fan)
+            heights[row] = found.key()
+        return cls(cards, lengths, heights)
+
+    def position(self, row: int) -> Tuple[Tableau, Foundations]:
+        "Return deal number /row/ as a new tableau and foundation."
+        tableau = Tableau()
+        for fan_cards, length in zip(self.cards[row], self.lengths[row]):
+            if length:
+                tableau.add_fan(Fan([CARDS[i] for i in fan_cards[:length]]))
+        return tableau, Foundations.from_heights(self.heights[row].tolist())
+
+    def foundation_counts(self) -> np.ndarray:
+        "The number of cards on the foundation of each deal."
+        return self.heights.sum(axis=1, dtype=np.int32)
+
+    def top_cards(self, rows: np.ndarray) -> np.ndarray:
+        """
+        The id of each fan's top card (NO_CARD if it's empty) in the deals
+        in /rows/, shaped (rows, fans).
+        """
+        lengths = self.lengths[rows]
+        top_slot = np.maximum(lengths - 1, 0)[..., None].astype(np.intp)
+        tops = np.take_along_axis(self.cards[rows], top_slot, axis=2)[..., 0]
+        return np.where(lengths > 0, tops, NO_CARD)
+
+    def play_foundation_moves(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Move every top card of the deals in /rows/ that can go on the
+        foundation there, as solve.move_players() does. Only one card of
+        each suit can go up at a time, so every fan can be played from at
+        once. Return the deals (among /rows/) where a card was moved.
+        """
+        tops = self.top_cards(rows)
+        suits, offsets = np.divmod(tops, 13)
+        playable = (tops != NO_CARD) & (np.take_along_axis(
+            self.heights[rows], np.minimum(suits, 3), axis=1) == offsets)
+        deal_idx, fan_idx = np.nonzero(playable)
+        deal_rows = rows[deal_idx]
+        self.lengths[deal_rows, fan_idx] -= 1
+        self.cards[deal_rows, fan_idx, self.lengths[deal_rows, fan_idx]] = NO_CARD
+        self.heights[deal_rows, suits[deal_idx, fan_idx]] += 1
+        np.add.at(self.foundation_moves, deal_rows, 1)
+        return rows[playable.any(axis=1)]
+
+    def make_safe_build(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Make one safe build in each of the deals in /rows/ that has one: the
+        build onto the leftmost fan that can take one safely (see
+        Fan.safe_build()), as solve.safe_builds() does. Return the deals
+        (among /rows/) where a card was moved.
+        """
+        tops = self.top_cards(rows)
+        lengths = self.lengths[rows].astype(np.intp)
+        wanted = tops - 1
+        has_wanted = (tops != NO_CARD) & (tops % 13 != 0)
+        source = np.take_along_axis(top_fans(tops),
+                                    np.where(has_wanted, wanted, NO_CARD), axis=1)
+        below_top = np.take_along_axis(
+            self.cards[rows], np.maximum(lengths - 2, 0)[..., None], axis=2)[..., 0]
+        safe = has_wanted & (source >= 0) & (
+            (lengths == 1) | (tops % 13 == 12) | ((lengths >= 2) & (below_top == tops + 1)))
+
+        built = safe.any(axis=1)
+        deal_idx = np.nonzero(built)[0]
+        target = safe[deal_idx].argmax(axis=1)
+        source = source[deal_idx, target]
+        card = wanted[deal_idx, target]
+        deal_rows = rows[deal_idx]
+        self.lengths[deal_rows, source] -= 1
+        self.cards[deal_rows, source, self.lengths[deal_rows, source]] = NO_CARD
+        self.cards[deal_rows, target, self.lengths[deal_rows, target]] = card
+        self.lengths[deal_rows, target] += 1
+        self.safe_builds[deal_rows] += 1
+        return deal_rows
+
+    def run_automatic_actions(self) -> None:
+        """
+        Make all the automatic moves in every deal, in the same order as
+        solve.run_automatic_actions() (starting from a position where
+        anything may be possible), leaving each deal in the same position:
+        all the foundation moves possible, then the safe builds one at a
+        time until there are none left, and over again until a round makes
+        no safe builds.
+
+        Each deal goes through these phases at its own pace; each step
+        makes one round of foundation moves or one safe build in every deal
+        that isn't finished, so the number of steps depends on the longest
+        deal rather than the number of deals.
+        """
+        phase = np.full(len(self), PLAYING, dtype=np.int8)
+        built = np.zeros(len(self), dtype=bool)
+        while True:
+            playing = np.nonzero(phase == PLAYING)[0]
+            building = np.nonzero(phase == BUILDING)[0]
+            if not len(playing) and not len(building):
+                return
+            if len(building):
+                moved = self.make_safe_build(building)
+                stuck = np.setdiff1d(building, moved, assume_unique=True)
+                built[moved] = True
+                # Back to the foundation if any safe builds were made this time.
+                phase[stuck] = np.where(built[stuck], PLAYING, DONE)
+            if len(playing):
+                moved = self.play_foundation_moves(playing)
+                stuck = np.setdiff1d(playing, moved, assume_unique=True)
+                phase[stuck] = BUILDING
+                built[stuck] = False
+
+
+def top_fans(tops: np.ndarray) -> np.ndarray:
+    """
+    Given the top_cards() of some deals, return the fan each card id is the
+    top card of in each deal, or -1, shaped (deals, 53).
+    """
+    fans = np.full((len(tops), NO_CARD + 1), -1, dtype=np.int16)
+    fans[np.arange(len(tops))[:, None], tops] = np.arange(tops.shape[1])[None, :]
+    fans[:, NO_CARD] = -1
+    return fans
+
+
+def check_against_solver(batch: DealBatch, before: DealBatch) -> List[int]:
+    """
+    Make the automatic moves in each deal of /before/ (an unplayed copy of
+    /batch/) with solve.run_automatic_actions(), and return the deals where
+    the position or the number of each kind of move differs from /batch/.
+    """
+    mismatches = []
+    for row in range(len(before)):
+        tableau, found = before.position(row)
+        move_stack: list = []
+        run_automatic_actions(tableau, found, move_stack)
+        safe_builds = sum(move.is_safe for move in move_stack)
+        expected = batch.position(row)
+        if (repr(tableau) != repr(expected[0]) or found.key() != expected[1].key()
+                or safe_builds != batch.safe_builds[row]
+                or len(move_stack) - safe_builds != batch.foundation_moves[row]):
+            mismatches.append(row)
+    return mismatches
+
+
+def autoplay_report(batch: DealBatch, elapsed: float) -> str:
+    "Describe how far the automatic moves got in the deals of /batch/."
+    counts = batch.foundation_counts()
+    games = len(batch)
+    cleared = int((counts == 52).sum())
+    lines = [
+        f"Played the automatic moves of {games} deal(s) in {elapsed:.2f}s "
+        f"({games / elapsed if elapsed else 0:.0f} deals/sec).",
+        f"Cleared by automatic moves alone: {cleared} ({cleared / games * 100:.2f}%).",
+        f"Cards on the foundation before the first blocking move: mean {counts.mean():.2f}; "
+        f"safe builds made: mean {batch.safe_builds.mean():.2f}.",
+        "",
+        "Cards left on the tableau before the first blocking move:",
+    ]
+    lines.extend(cards_left_histogram(Counter((52 - counts).tolist())))
+    return '\n'.join(lines)
+
+
+def run_autoplay(args) -> int:
+    """
+    Deal args.games games as `lbl simulate` would (starting from game
+    number args.first), make the automatic moves
+    in all of them at once, and print statistics about how far they got.
+    If args.check is set, also check the results against the solver's own
+    automatic moves. Return the exit status.
+    """
+    seed = args.seed if args.seed is not None else random.randrange(2**32)
+    print(f"Dealing {args.games} game(s) with seed {seed}"
+          + (f", starting from game {args.first}" if args.first else "") + "...")
+    batch = DealBatch.deal(seed, args.first, args.games)
+    before = DealBatch(batch.cards.copy(), batch.lengths.copy(), batch.heights.copy())
+
+    watch = Stopwatch()
+    batch.run_automatic_actions()
+    watch.checkpoint()
+    print(autoplay_report(batch, watch.running_time))
+
+    if args.check:
+        mismatches = check_against_solver(batch, before)
+        if mismatches:
+            sys.stderr.write(f"Oops! {len(mismatches)} deal(s) differ from the solver, "
+                             f"e.g., game {args.first + mismatches[0]}.\n")
+            return 1
+        print("")
+        print(f"Checked: all {args.games} deal(s) match the solver's automatic moves.")
+    return 0
@@ -0,0 +1,99 @@
+import json
+import random
+import sys
+import time
+from typing import IO, Iterator, Tuple
+
+from .cache import open_cache
+from .notation import parse_record
+from .parallel import SearchPool, worker_state
+from .simulate import game_rng
+from .solve import GameResult, solve_game
+
+
+def read_tasks(stream: IO[str], options: dict) -> Iterator[Tuple[int, str, dict]]:
+    """
+    Yield a task for solve_task() for each position in /stream/, one per
+    line. Blank lines and lines starting with '#' are skipped.
+    """
+    for line_num, line in enumerate(stream, start=1):
+        if line.strip() and not line.lstrip().startswith('#'):
+            yield line_num, line, options
+
+
+def game_record(line_num: int, ident, result: GameResult) -> dict:
+    "Summarize the result of solving a game as a JSON-serializable dict."
+    final = result.deals[-1]
+    return {
+        'line': line_num,
+        'id': ident,
+        'solved': result.solved,
+        'optimal': result.optimal,
+        'deals': len(result.deals),
+        'foundation': result.foundation_count,
+        'cards_left': len(final.tableau),
+        'nodes': sum(deal.num_moves for deal in result.deals),
+        'time': round(result.elapsed, 6),
+        'moves': [[move.notation() for move in deal.useful_moves]
+                  for deal in result.deals],
+    }
+
+
+def solve_task(task: Tuple[int, str, dict]) -> dict:
+    """
+    Solve the position on one line of a batch in a SearchPool worker,
+    returning its result record.
+    """
+    line_num, line, options = task
+    try:
+        ident, tableau, found = parse_record(line)
+    except ValueError as e:
+        return {'line': line_num, 'id': None, 'error': str(e)}
+
+    # Seed each game separately, so its redeals don't depend on which worker
+    # happened to solve it or what that worker solved before.
+    seed = options['seed']
+    rng = game_rng(seed, line_num) if seed is not None else random.Random()
+    result = solve_game(tableau, found, options['deal'], options['max_deal'],
+                        options['redeal'], options['merci'], rng,
+                        table=worker_state().table, time_limit=options['time_limit'],
+                        max_nodes=options['max_nodes'], por=options['por'],
+                        stats=options['stats'] is not None,
+                        cache=(open_cache(options['cache'], options['cache_size'])
+                               if options['cache'] is not None else None))
+    record = game_record(line_num, ident, result)
+    if options['stats'] is not None:
+        record['stats'] = [deal.stats_record() for deal in result.deals]
+    return record
+
+
+def run_batch(args) -> int:
+    """
+    Solve every position in the file args.input (or standard input), writing
+    a JSON record for each to standard output as soon as it's solved.
+    Return the exit status: 0 if every line could be read, 255 otherwise.
+    """
+    options = {'deal': args.deal, 'max_deal': args.max_deal, 'redeal': args.redeal,
+               'merci': args.merci, 'seed': args.seed, 'time_limit': args.time_limit,
+               'max_nodes': args.max_nodes, 'por': args.por, 'stats': args.stats,
+               'cache': args.cache, 'cache_size': args.cache_size}
+    stream = open(args.input, encoding='utf-8') if args.input not in (None, '-') else sys.stdin
+
+    start = time.perf_counter()
+    positions = solved = errors = 0
+    with stream, SearchPool(args.jobs, args.table_size, args.table_policy) as pool:
+        # Keep only a few positions per worker in flight, so memory use
+        # doesn't depend on the size of the input.
+        window = pool.jobs * 4
+        for record in pool.imap_unordered(solve_task, read_tasks(stream, options), window):
+            print(json.dumps(record, ensure_ascii=False), flush=True)
+            positions += 1
+            if 'error' in record:
+                errors += 1
+            elif record['solved']:
+                solved += 1
+
+    elapsed = time.perf_counter() - start
+    sys.stderr.write(f"Solved {solved} of {positions - errors} position(s) in {elapsed:.2f}s"
+                     + (f"; {errors} line(s) could not be read.\n" if errors else ".\n"))
+    return 255 if errors else 0
@@ -0,0 +1,199 @@
+import json
+import os
+import platform
+import sys
+import time
+from typing import Dict, List, Optional
+
+from .notation import parse_line
+from .solve import solve_deal
+from .transposition import TranspositionTable
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+DEFAULT_CORPUS = os.path.join(BENCHMARKS_DIR, 'corpus.jsonl')
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, 'baseline.json')
+
+
+def read_corpus(path: str) -> List[dict]:
+    """
+    Read the benchmark positions in the file at /path/, one JSON object per
+    line with an "id", a "category", the "position" in the notation of
+    notation.parse_line(), and optionally "merci": true to allow a merci.
+    Blank lines and lines starting with '#' are skipped.
+    Raise ValueError if a line can't be read.
+    """
+    entries = []
+    with open(path, encoding='utf-8') as f:
+        for line_num, line in enumerate(f, start=1):
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+            try:
+                entry = json.loads(line)
+                if not isinstance(entry, dict) or 'id' not in entry or 'position' not in entry:
+                    raise ValueError('expected an object with an "id" and a "position"')
+                parse_line(entry['position'])
+            except ValueError as e:
+                raise ValueError(f"line {line_num} of {path}: {e}") from e
+            entry.setdefault('category', '')
+            entries.append(entry)
+    return entries
+
+
+def bench_position(entry: dict, repeat: int) -> dict:
+    """
+    Solve the first deal of one benchmark position /repeat/ times in this
+    process, each time from scratch with a new transposition table. Return
+    a dict of the foundation count reached, the legal permutations searched,
+    and the fastest wall time of the runs.
+    """
+    times = []
+    for _ in range(repeat):
+        tableau, found = parse_line(entry['position'])
+        start = time.perf_counter()
+        result = solve_deal(tableau, found, merci=entry.get('merci', False),
+                            table=TranspositionTable())
+        times.append(time.perf_counter() - start)
+    return {'foundation': len(result.foundation), 'nodes': result.num_moves,
+            'time': round(min(times), 6)}
+
+
+def compare(ident: str, result: dict, base: Optional[dict], time_tolerance: float,
+            node_tolerance: float, min_time: float) -> List[str]:
+    """
+    Return a description of each way /result/ is worse than the baseline
+    result /base/ for the same position: a lower foundation count, more
+    than /node_tolerance/ (a fraction) more nodes, or more than
+    /time_tolerance/ more time, ignoring differences of under /min_time/
+    seconds, which are mostly noise.
+    """
+    if base is None:
+        return []
+    problems = []
+    if result['foundation'] < base['foundation']:
+        problems.append(f"{ident}: foundation count fell from {base['foundation']} "
+                        f"to {result['foundation']}")
+    if result['nodes'] > base['nodes'] * (1 + node_tolerance):
+        problems.append(f"{ident}: nodes searched rose from {base['nodes']} "
+                        f"to {result['nodes']}")
+    if (result['time'] > base['time'] * (1 + time_tolerance)
+            and result['time'] - base['time'] >= min_time):
+        problems.append(f"{ident}: time rose from {base['time']:.3f}s "
+                        f"to {result['time']:.3f}s")
+    return problems
+
+
+def load_baseline(path: str) -> Dict[str, dict]:
+    "Read the per-position results stored by save_baseline()."
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['positions']
+
+
+def save_baseline(path: str, results: Dict[str, dict]) -> None:
+    """
+    Store /results/ (a dict mapping position id to result) as the baseline
+    in the file at /path/, keeping the results for any other positions
+    already stored there.
+    """
+    positions = load_baseline(path) if os.path.exists(path) else {}
+    positions.update(results)
+    baseline = {'python': platform.python_version(), 'machine': platform.machine(),
+                'positions': positions}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=1, sort_keys=True)
+        f.write("\n")
+
+
+def check_por(entries: List[dict]) -> int:
+    """
+    Solve the first deal of each of /entries/ both with and without
+    partial-order reduction, printing a line for each, and check that both
+    reach the same foundation count: the reduction should only save work,
+    never miss the best line. Return the exit status: 0 if every count
+    matches, 1 if any differs.
+    """
+    print(f"{'Position':<12} {'Category':<8} {'Found':>5} {'Nodes':>9}   "
+          f"{'No POR':>6} {'Nodes':>9}")
+    mismatches = []
+    for entry in entries:
+        counts = []
+        for por in (True, False):
+            tableau, found = parse_line(entry['position'])
+            result = solve_deal(tableau, found, merci=entry.get('merci', False),
+                                table=TranspositionTable(), por=por)
+            counts.append((len(result.foundation), result.num_moves))
+        (with_por, por_nodes), (without, plain_nodes) = counts
+        print(f"{entry['id']:<12} {entry['category']:<8} {with_por:>5} {por_nodes:>9}   "
+              f"{without:>6} {plain_nodes:>9}" + ("   MISMATCH" if with_por != without else ""),
+              flush=True)
+        if with_por != without:
+            mismatches.append(entry['id'])
+
+    if mismatches:
+        print("")
+        print(f"Partial-order reduction changed the best foundation count of "
+              f"{len(mismatches)} position(s): {', '.join(mismatches)}")
+        return 1
+    print(f"Partial-order reduction found the same foundation count "
+          f"for all {len(entries)} position(s).")
+    return 0
+
+
+def run_bench(args) -> int:
+    """
+    Benchmark the search on each position in args.corpus, printing a line
+    for each, then either store the results as the baseline (with
+    args.save_baseline) or compare them to it. Return the exit status: 0
+    if nothing regressed, 1 if anything did, 255 if the files can't be read.
+    With args.check_por, run check_por() on the positions instead.
+    """
+    try:
+        entries = read_corpus(args.corpus)
+        if args.category:
+            entries = [e for e in entries if e['category'] in args.category]
+        baseline = ({} if args.save_baseline or args.check_por
+                    else load_baseline(args.baseline))
+    except (OSError, ValueError, KeyError) as e:
+        sys.stderr.write(f"Oops! Unable to read the benchmarks: {e}\n")
+        return 255
+    if args.check_por:
+        return check_por(entries)
+
+    print(f"{'Position':<12} {'Category':<8} {'Found':>5} {'Nodes':>9} {'Time':>9}   Baseline")
+    results: Dict[str, dict] = {}
+    problems = []
+    for entry in entries:
+        ident = entry['id']
+        result = bench_position(entry, args.repeat)
+        results[ident] = result
+        base = baseline.get(ident)
+        print(f"{ident:<12} {entry['category']:<8} {result['foundation']:>5} "
+              f"{result['nodes']:>9} {result['time']:>8.3f}s   "
+              + (f"{base['foundation']:>5} {base['nodes']:>9} {base['time']:>8.3f}s"
+                 if base is not None else "(none)"), flush=True)
+        problems.extend(compare(ident, result, base, args.time_tolerance,
+                                args.node_tolerance, args.min_time))
+
+    total = sum(r['time'] for r in results.values())
+    print(f"Total time: {total:.3f}s", end='')
+    if not args.save_baseline:
+        compared = [i for i in results if i in baseline]
+        new_total = sum(results[i]['time'] for i in compared)
+        base_total = sum(baseline[i]['time'] for i in compared)
+        print(f" (baseline {base_total:.3f}s for {len(compared)} position(s))", end='')
+        if (new_total > base_total * (1 + args.time_tolerance)
+                and new_total - base_total >= args.min_time):
+            problems.append(f"total time rose from {base_total:.3f}s to {new_total:.3f}s")
+    print("")
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"Saved the results as the baseline in {args.baseline}.")
+        return 0
+    if problems:
+        print("")
+        print(f"{len(problems)} regression(s):")
+        for problem in problems:
+            print("  " + problem)
+        return 1
+    print("No regressions.")
+    return 0
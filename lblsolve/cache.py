@@ -0,0 +1,201 @@
+import os
+import re
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .card import CARDS, Card
+from .lucie import Foundations, Move, Tableau
+from .solve import FOUNDATION_FLAG, MERCI_FLAG
+from .state import symmetric_canonical
+
+DEFAULT_CACHE_SIZE = 100_000
+
+# Bump this when the stored results would no longer be valid, e.g., if the
+# rules of automatic play change; a cache written under another version is
+# emptied when opened.
+CACHE_VERSION = 1
+
+# A blocking move or merci, identified as by solve.move_key(): the card's id,
+# with flags for whether it was a merci and whether it went to the foundation.
+MoveKey = int
+
+_MOVE_PATTERN = re.compile("([BM]):([0-9AJQK]{1,2}[CDHS])>([0-9AJQK]{1,2}[CDHS]|F)")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key BLOB PRIMARY KEY,
+    foundation INTEGER NOT NULL,
+    moves TEXT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+_COUNTERS = ('version', 'hits', 'misses', 'stores', 'evictions')
+
+
+def _relabel(card: Card, perm: Tuple[int, ...]) -> Card:
+    "Return the card /card/ becomes when suit i is relabeled as suit perm[i]."
+    return CARDS[perm[card.id // 13] * 13 + card.id % 13]
+
+
+def _inverse(perm: Tuple[int, ...]) -> Tuple[int, ...]:
+    inverse = [0] * len(perm)
+    for suit_idx, new_idx in enumerate(perm):
+        inverse[new_idx] = suit_idx
+    return tuple(inverse)
+
+
+class SolutionCache:
+    """
+    A persistent store of the best lines found for deals, in an SQLite
+    database at /path/, so solving a position that has been solved before is
+    a lookup rather than a search.
+
+    Results are keyed by the position at the start of the search, encoded
+    by state.symmetric_canonical() so that positions differing only in the
+    order of the fans or the names of the suits share a result, and by
+    whether a merci is allowed. Only the foundation count and the blocking
+    moves and mercis of the best line are stored; the automatic moves are
+    made again when the line is replayed. Only lines proven to be the best
+    possible should be stored.
+
+    The cache holds at most /max_entries/ results; when it is full, storing
+    a new one evicts the least recently used. Several processes can share
+    one cache file.
+    """
+    def __init__(self, path: str, max_entries: int = DEFAULT_CACHE_SIZE) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self._db = sqlite3.connect(path, timeout=60)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+        with self._db:
+            for name in _COUNTERS:
+                self._db.execute("INSERT OR IGNORE INTO counters VALUES (?, 0)", (name,))
+        if self.counters()['version'] != CACHE_VERSION:
+            self.clear()
+
+    def close(self) -> None:
+        self._db.close()
+
+    def __enter__(self) -> 'SolutionCache':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def key(self, tableau: Tableau, foundation: Foundations,
+            merci: bool) -> Tuple[bytes, Tuple[int, ...]]:
+        """
+        Return the key for a position and the suit relabeling that maps the
+        position onto the key (to pass on to lookup() and store()).
+        """
+        encoding, perm = symmetric_canonical(tableau, foundation)
+        return encoding + (b'M' if merci else b''), perm
+
+    def lookup(self, key: bytes, perm: Tuple[int, ...]) -> Optional[Tuple[int, List[MoveKey]]]:
+        """
+        Return the foundation count and the blocking moves and mercis of the
+        best line stored for /key/, with the suits relabeled by the inverse
+        of /perm/ to match the position the key was made from; or None if
+        the position isn't in the cache.
+        """
+        row = self._db.execute("SELECT foundation, moves FROM results WHERE key = ?",
+                               (key,)).fetchone()
+        if row is None:
+            with self._db:
+                self._count('misses')
+            return None
+        with self._db:
+            self._db.execute("UPDATE results SET hits = hits + 1, last_used = ? WHERE key = ?",
+                             (time.time(), key))
+            self._count('hits')
+        inverse = _inverse(perm)
+        line = []
+        for kind, card_text, target in _MOVE_PATTERN.findall(row[1]):
+            line.append(_relabel(Card.from_text(card_text), inverse).id
+                        | (MERCI_FLAG if kind == 'M' else 0)
+                        | (FOUNDATION_FLAG if target == 'F' else 0))
+        return row[0], line
+
+    def store(self, key: bytes, perm: Tuple[int, ...], foundation_count: int,
+              moves: List[Move]) -> None:
+        """
+        Record the best line from the position identified by /key/: the
+        foundation count it reaches and its /moves/ (any automatic moves
+        among them are left out), in the position's own suits, which /perm/
+        maps onto the key's.
+        """
+        notations = []
+        for move in moves:
+            if move.is_merci or not (move.is_safe or move.is_foundation_move):
+                target = 'F' if move.is_foundation_move else _relabel(move.card.after(), perm).text
+                notations.append(f"{'M' if move.is_merci else 'B'}:"
+                                 f"{_relabel(move.card, perm).text}>{target}")
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO results (key, foundation, moves, last_used) "
+                             "VALUES (?, ?, ?, ?)",
+                             (key, foundation_count, ' '.join(notations), time.time()))
+            self._count('stores')
+            excess = len(self) - self.max_entries
+            if excess > 0:
+                self._db.execute("DELETE FROM results WHERE key IN (SELECT key FROM results "
+                                 "ORDER BY last_used LIMIT ?)", (excess,))
+                self._count('evictions', excess)
+
+    def clear(self) -> None:
+        "Remove every result and reset the counters."
+        with self._db:
+            self._db.execute("DELETE FROM results")
+            self._db.execute("UPDATE counters SET value = 0")
+            self._db.execute("UPDATE counters SET value = ? WHERE name = 'version'",
+                             (CACHE_VERSION,))
+
+    def counters(self) -> Dict[str, int]:
+        "Return the cache's lifetime hit, miss, store and eviction counts."
+        return dict(self._db.execute("SELECT name, value FROM counters"))
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        self._db.execute("UPDATE counters SET value = value + ? WHERE name = ?", (amount, name))
+
+    def report(self) -> str:
+        "Describe the cache's size and how well it has worked."
+        counters = self.counters()
+        lookups = counters['hits'] + counters['misses']
+        rate = counters['hits'] / lookups * 100 if lookups else 0.0
+        size = sum(os.path.getsize(self.path + suffix) for suffix in ('', '-wal')
+                   if os.path.exists(self.path + suffix))
+        merci = self._db.execute("SELECT COUNT(*) FROM results WHERE substr(key, -1) = X'4D'"
+                                 ).fetchone()[0]
+        return "\n".join([
+            f"Cache {self.path}: {size / 1024:.1f} KiB on disk.",
+            f"{len(self)} result(s) stored ({merci} with a merci allowed).",
+            f"{lookups} lookup(s): {counters['hits']} hit(s), {counters['misses']} miss(es) "
+            f"({rate:.1f}% hit rate).",
+            f"{counters['stores']} result(s) stored, {counters['evictions']} evicted "
+            f"to keep the cache to its size limit.",
+        ])
+
+
+_open_caches: Dict[Tuple[str, int], SolutionCache] = {}
+
+
+def open_cache(path: str, max_entries: int = DEFAULT_CACHE_SIZE) -> SolutionCache:
+    """
+    Return a SolutionCache for /path/, reusing the one this process already
+    has open if there is one (e.g., in a SearchPool worker solving many
+    positions).
+    """
+    cache = _open_caches.get((path, max_entries))
+    if cache is None:
+        cache = _open_caches[path, max_entries] = SolutionCache(path, max_entries)
+    return cache
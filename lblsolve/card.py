@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 import collections
+import hashlib
 import random
 import re
-from typing import Deque, Iterable, Iterator, Optional
+from typing import Deque, Iterable, Iterator, MutableSequence, Optional, Tuple, Union
 
 SUITS = ('C', 'D', 'H', 'S')
 NUMS = list(range(1,14))
@@ -16,46 +17,65 @@ class Card:
     """
     Represents a single playing card from a standard 52-card deck. It has a
     suit and a number. Cards are immutable once created.
+
+    There is only ever one Card object for each of the 52 cards: calling
+    Card(num, suit) returns the shared instance from a fixed table, so cards
+    can be compared by identity and creating a card never allocates. Each
+    card also has a small integer /id/ (0-51), grouped by suit in the order
+    of SUITS, and knows the cards before and after it in its suit.
+
+    >>> Card(5, 'D') is Card(5, 'D')
+    True
+    >>> Card(5, 'D').id
+    17
     """
-    def __init__(self, num: int, suit: str) -> None:
+    __slots__ = ('_suit', '_num', 'id', '_before', '_after')
+
+    def __new__(cls, num: int, suit: str) -> Card:
         assert suit in SUITS
         assert num in NUMS
-        self._suit = suit
-        self._num = num
-
-    def __eq__(self, other: object) -> bool:
-        if not isinstance(other, Card):
-            return NotImplemented
-        return self._suit == other._suit and self._num == other._num
+        return CARDS[SUITS.index(suit) * 13 + num - 1]
 
+    # Equality is the default identity comparison, since cards are unique.
     def __hash__(self) -> int:
-        # assert: unique and small across all suit/num combinations
-        # ords: C = 67, D = 68, H = 72, S = 83
-        return ord(self._suit) + self._num
+        return self.id
+
+    def __reduce__(self):
+        # Unpickling must return the shared instance, not a new object.
+        return (Card, (self._num, self._suit))
+
+    def __copy__(self) -> Card:
+        return self
+
+    def __deepcopy__(self, memo) -> Card:
+        return self
 
     def __repr__(self) -> str:
         return f"{self.name}{self.suit_glyph}"
 
     @classmethod
-    def from_text(cls, text: str) -> Optional[Card]:
-        """
-        Given a card string such as "10S", return a Card, or None if the string
-        doesn't match the required format.
+    def from_id(cls, card_id: int) -> Card:
         """
-        num = text[:-1]
-        suit = text[-1]
+        Return the card with the given id.
 
-        if suit.upper() in SUIT_LETTERS:
-            clean_suit = SUIT_LETTERS[suit.upper()]
-        else:
-            clean_suit = suit.upper()
+        >>> Card.from_id(51)
+        K♠
+        """
+        return CARDS[card_id]
 
-        clean_num = NUMS[NAMES.index(num.upper())]
+    @classmethod
+    def from_text(cls, text: str) -> Optional[Card]:
+        """
+        Given a card string such as "10S", return a Card, or None if the string
+        doesn't match the required format. The number may also be lowercase,
+        and the suit lowercase or a Unicode suit glyph.
 
-        if clean_suit not in SUITS or clean_num not in NUMS:
-            return None
-        else:
-            return cls(clean_num, clean_suit)
+        >>> Card.from_text('qh')
+        Q♥
+        >>> Card.from_text('1H') is None
+        True
+        """
+        return CARDS_BY_TEXT.get(text)
 
     @property
     def name(self) -> str:
@@ -68,6 +88,16 @@ class Card:
         """
         return NAMES[self._num - 1]
 
+    @property
+    def text(self) -> str:
+        """
+        The card written in plain ASCII, in the form from_text() reads.
+
+        >>> Card(10, 'S').text
+        '10S'
+        """
+        return f"{self.name}{self._suit}"
+
     @property
     def num(self) -> int:
         """
@@ -100,7 +130,7 @@ class Card:
 
     def after(self) -> Optional[Card]:
         """
-        Create and return the card after this one (that is, the one with the
+        Return the card after this one (that is, the one with the
         same suit and the next number in sequence). Aces are low. Calling
         after() on a king yields None.
 
@@ -112,13 +142,11 @@ class Card:
         >>> c.after() is None
         True
         """
-        if self.num == 13:
-            return None
-        return Card(self.num + 1, self.suit)
+        return self._after
 
     def before(self) -> Optional[Card]:
         """
-        Create and return the card before this one (that is, the one with the
+        Return the card before this one (that is, the one with the
         same suit and the previous number in sequence). Aces are low; calling
         before() on one yields None.
 
@@ -130,9 +158,35 @@ class Card:
         >>> c.before() is None
         True
         """
-        if self.num == 1:
-            return None
-        return Card(self.num - 1, self.suit)
+        return self._before
+
+
+def _build_cards() -> Tuple[Card, ...]:
+    """
+    Create the 52 shared Card instances, indexed by card id, and link each
+    to its neighbors in suit.
+    """
+    cards = []
+    for suit in SUITS:
+        for num in NUMS:
+            card = object.__new__(Card)
+            card._suit = suit
+            card._num = num
+            card.id = len(cards)
+            cards.append(card)
+    for card in cards:
+        card._before = cards[card.id - 1] if card._num > 1 else None
+        card._after = cards[card.id + 1] if card._num < 13 else None
+    return tuple(cards)
+
+
+CARDS = _build_cards()
+
+# Every spelling Card.from_text() accepts, mapped to its card.
+CARDS_BY_TEXT = {f"{name}{suit}": card
+                 for card in CARDS
+                 for name in {card.name, card.name.lower()}
+                 for suit in (card.suit, card.suit.lower(), card.suit_glyph)}
 
 
 class Stack:
@@ -191,6 +245,51 @@ class Deck(Stack):
             for num in NUMS:
                 self.add(Card(num, suit))
 
-    def shuffle(self):
-        "Shuffle all cards currently in the deck."
-        random.shuffle(self._cards)
+    def shuffle(self, rng: Union[random.Random, Shuffler, None] = None):
+        """
+        Shuffle all cards currently in the deck, using the random number
+        generator or Shuffler /rng/ if provided (e.g., to make the shuffle
+        reproducible).
+        """
+        (rng or random).shuffle(self._cards)
+
+
+class Shuffler:
+    """
+    The shuffles of game number /index/ of a run seeded with /seed/, to be
+    passed to Deck.shuffle() in place of a random number generator: the
+    first deals the game, and each one after that shuffles a redeal.
+
+    Each shuffle is worked out directly from the seed, the game number and
+    the number of shuffles made so far, rather than drawn from a random
+    number generator's stream, so any game of a run can be dealt on its own
+    in microseconds, whatever process or machine deals it, and a run
+    can be split into ranges of game numbers and still deal the same games.
+
+    >>> deck = Deck()
+    >>> deck.fill()
+    >>> deck.shuffle(Shuffler(7, 1000000))
+    >>> deck.draw()
+    5♦
+    """
+    def __init__(self, seed, index: int) -> None:
+        self._key = hashlib.blake2b(f"{seed}:{index}".encode(), digest_size=32).digest()
+        self.shuffles = 0
+
+    def shuffle(self, cards: MutableSequence) -> None:
+        """
+        Shuffle /cards/ in place, like random.Random.shuffle(), with the next
+        shuffle of the game.
+
+        A 512-bit hash of the shuffle number, keyed by the seed and game
+        number, is read as a mixed-radix number whose digits pick the swaps
+        of a Fisher-Yates shuffle. There are far more hash values than ways
+        to order a deck (52! is about 2**226), so every order is equally
+        likely, to within one part in 2**286.
+        """
+        number = int.from_bytes(hashlib.blake2b(self.shuffles.to_bytes(8, 'big'),
+                                                key=self._key).digest(), 'big')
+        self.shuffles += 1
+        for i in range(len(cards) - 1, 0, -1):
+            number, j = divmod(number, i + 1)
+            cards[i], cards[j] = cards[j], cards[i]
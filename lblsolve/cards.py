@@ -1,28 +1,101 @@
 #!/usr/bin/python3
 
-import re
+import json
+import os
+import sqlite3
 import sys
-from typing import NoReturn, Optional
+from typing import NoReturn, Optional, Tuple
 
 import argparse
 
-from .card import Card, Deck
+from .card import Deck
 from .instrument import Stopwatch
-from .lucie import Fan, Foundations, Tableau
-from .solve import play_deal
+from .lucie import Foundations, Tableau
+from .notation import (COMPACT_PREFIX, format_compact, format_line, parse_compact, parse_fan,
+                       position_from_fans, run_convert)
+from .batch import run_batch
+from .bench import DEFAULT_BASELINE, DEFAULT_CORPUS, run_bench
+from .cache import DEFAULT_CACHE_SIZE, SolutionCache
+from .parallel import SearchPool
+from .redeal import EndStateChooser
+from .simulate import deal_game, game_rng, run_simulation
+from .solve import DealResult, solve_game
+from .state import load_position, save_position
+from .transposition import DEFAULT_SIZE, EVICTION_POLICIES
 
 
 
-def check_won(tableau: Tableau, deals: int, watch: Stopwatch) -> None:
-    if not tableau:
+def print_deal_start(deal: int, tableau: Tableau, found: Foundations) -> None:
+    "Show the position at the start of a deal, before it is searched."
+    print("")
+    print(f"========== Deal {deal} ==========")
+    print("Starting tableau:")
+    print(tableau)
+    print("")
+    if found:
+        print("Starting foundation:")
+        print(found)
         print("")
-        watch.checkpoint()
-        print(f"Game solved in {watch.running_time * 1000:.2f}ms on deal {deals}.")
-        sys.exit(0)
 
 
-def parse_position() -> Deck:
-    fans = []
+def print_deal_result(result: DealResult, stats: Optional[str] = None) -> None:
+    """
+    Show the best line found for a deal and the final position. If /stats/
+    is 'json', the deal's DealResult.stats_record() is also written to
+    standard error as one line of JSON.
+    """
+    tableau, found, move_stack = result.tableau, result.foundation, result.moves
+    if len(found) == 52 and not result.num_moves and not result.cached:
+        print("The deal was solved by automatic moves.")
+    elif result.cached:
+        print("  Found the best sequence in the solution cache.", end='')
+    else:
+        print(f"\r  Found {result.num_moves} total legal permutation(s) "
+              f"of blocking moves.   ", end='')
+        if result.table is not None:
+            print("")
+            print(f"  Transposition table: {result.table}", end='')
+        if not result.optimal:
+            print("")
+            print("  Search " + ("interrupted" if result.interrupted else "limit reached")
+                  + "; showing the best sequence found so far, "
+                    "which may not be the best possible.", end='')
+
+    useful_moves = result.useful_moves
+    print("")
+    if not useful_moves:
+        print("Darn! No legal moves from this position would allow a foundation move.")
+    else:
+        print(f"Best sequence has {len(useful_moves)} moves, "
+              f"transferring {result.cards_played} cards to the foundation "
+              f"and leaving {len(tableau)} on the tableau.")
+        print("")
+        print("Move sequence:")
+        for move in useful_moves:
+            print("  " + str(move))
+        if len(useful_moves) < len(move_stack):
+            print(f"  ({len(move_stack) - len(useful_moves)} further legal "
+                  f"move(s) omitted "
+                  f"because they do not enable any further foundation moves)")
+
+    if result.redeal_estimates is not None:
+        print("")
+        print("Chose the ending with the best chance of winning after the redeal:")
+        for estimate in result.redeal_estimates:
+            marker = '*' if estimate.result is result else ' '
+            print(f"  {marker} {estimate}")
+
+    print("")
+    print(f"Final table state after deal {result.deal}:")
+    print(tableau)
+    print("")
+    print(found)
+
+    if stats == 'json':
+        sys.stderr.write(json.dumps(result.stats_record()) + "\n")
+
+
+def parse_position() -> Tuple[Tableau, Foundations]:
     help_msg = ("La Belle Lucie solver\n"
                 "Copyright (c) 2022 Soren Bjornstad.\n"
                 "Use the --help switch for full command-line options.\n\n"
@@ -32,92 +105,68 @@ def parse_position() -> Deck:
                 "and H the suit of the card, 'C', 'D', 'H', or 'S' "
                 "(lowercase letters or Unicode suit glyphs also accepted).\n"
                 "Enter horizontal whitespace between cards of a fan "
-                "and Return between fans.\n"
+                "and Return between fans,\n"
+                f"or a whole position on one line in the compact form "
+                f"(starting with '{COMPACT_PREFIX}').\n"
                 "To finish entering fans, press ^D. "
                 "The foundations will consist of any cards not on your tableau.\n\n")
     if sys.stdin.isatty():
         sys.stderr.write(help_msg)
 
-    for line in sys.stdin:
-        fan_cards = []
-        for card_text in re.finditer("(?:[0-9]{1,2}|[AKQJakqj])[cCdDhHsS♣♦♥♠]", line):
-            # TODO: Better error checking in from_text
-            card = Card.from_text(card_text.group(0))
-            if card is None:
-                # TODO: This should happen if nonsense was found on the line, too
-                sys.stderr.write("Oops! That doesn't appear to be a valid card.")
-                sys.exit(255)
-            fan_cards.append(card)
-
-        fan = Fan(fan_cards)
-        fans.append(fan)
-        fan_cards.clear()
-        print(f"[Read fan {len(fans)-1:2d}]", fan)
-
-
-    tableau = Tableau()
-    tableau.fans.extend(fans)
-    all_cards = [c for fan in tableau.fans for c in fan]
-
-    if not all_cards:
-        print("No cards were entered on the tableau. Exiting.")
+    fans = []
+    try:
+        for line in sys.stdin:
+            if not fans and line.lstrip().startswith(COMPACT_PREFIX):
+                return parse_compact(line)
+            fans.append(parse_fan(line))
+            print(f"[Read fan {len(fans)-1:2d}]", fans[-1])
+        return position_from_fans(fans)
+    except ValueError as e:
+        sys.stderr.write(f"Oops! {e}\n")
         sys.exit(255)
-    assert len(all_cards) == len(set(all_cards)), \
-        "There appear to be duplicate cards in this tableau. Please check the tableau."
-
-    found = Foundations.infer(tableau)
 
-    return tableau, found
 
-
-def play_game(args, deck: Optional[Deck] = None, tableau: Optional[Tableau] = None,
-             found: Optional[Foundations] = None) -> NoReturn:
+def play_game(args, tableau: Tableau, found: Foundations) -> NoReturn:
     """
-    Play a game of LBS, beginning from either a shuffled /deck/
-    or an initial position with a /tableau/ and a /found/ation.
+    Play a game of LBS, beginning from the initial position with a /tableau/
+    and a /found/ation.
     """
-    assert deck is not None or (tableau is not None and found is not None)
-
     watch = Stopwatch()
-    if deck is not None:
-        tableau = Tableau()
-        found = Foundations()
-        tableau.deal(deck)
-    else:
-        # Leave deck empty, we'll fill it when redealing.
-        deck = Deck()
-
-    if not args.redeal:
-        iterator = range(args.deal, args.deal+1)
-    else:
-        iterator = range(args.deal, args.max_deal+1)
-
-    first_managed_deal = True
-    for deal_num in iterator:
-        if not first_managed_deal:
-            # If this isn't the first deal the solver has worked on,
-            # it should gather, shuffle, and redeal the tableau.
-            deck.add_many(tableau.gather())
-            deck.shuffle()
-            tableau.deal(deck)
-        first_managed_deal = False
-
-        if args.merci and (deal_num == args.max_deal or not args.redeal):
-            tableau, found = play_deal(tableau, found, deal_num, merci=True)
-        else:
-            tableau, found = play_deal(tableau, found, deal_num)
-        check_won(tableau, deal_num, watch)
+    cache = open_cache_or_exit(args)
+    try:
+        with SearchPool(args.jobs, args.table_size, args.table_policy) as pool:
+            choose_ending = None
+            if args.redeal and args.redeal_candidates > 1:
+                choose_ending = EndStateChooser(
+                    pool, args.redeal_samples, args.redeal_candidates, args.redeal_budget,
+                    args.redeal_seed, args.max_deal, args.merci, args.time_limit,
+                    args.max_nodes, args.por)
+            result = solve_game(tableau, found, args.deal, args.max_deal, args.redeal,
+                                args.merci, before_deal=print_deal_start,
+                                after_deal=lambda deal: print_deal_result(deal, args.stats),
+                                choose_ending=choose_ending,
+                                pool=pool, split_depth=args.split_depth, verbose=True,
+                                time_limit=args.time_limit, max_nodes=args.max_nodes,
+                                por=args.por, stats=args.stats is not None, cache=cache)
+    finally:
+        if cache is not None:
+            cache.close()
 
     print("")
     watch.checkpoint()
+    if result.solved:
+        print(f"Game solved in {watch.running_time * 1000:.2f}ms "
+              f"on deal {result.deals[-1].deal}.")
+        sys.exit(0)
+    if result.interrupted:
+        print(f"Interrupted during deal {result.deals[-1].deal}.")
+        sys.exit(130)
     print(f"Solution space exhausted in {watch.running_time * 1000:.2f}ms.")
     print("Unfortunately, no solutions were found.")
     sys.exit(1)
 
 
-def main() -> NoReturn:
-    parser = argparse.ArgumentParser(
-        description='Solve La Belle Lucie solitaire games.')
+def add_rule_options(parser: argparse.ArgumentParser) -> None:
     parser.add_argument("--deal", metavar='N', type=int, default=1,
         help='Numbered deal to begin on. The base rules have 3 deals.')
     parser.add_argument("--redeal", action='store_true', default=False,
@@ -128,24 +177,304 @@ def main() -> NoReturn:
     parser.add_argument("--merci", action='store_true', default=False,
         help='On the final deal, allow one card not on the top of its pile to be '
              'retrieved and played on the foundation or tableau.')
+
+
+def add_search_options(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--table-size", metavar='N', type=int, default=DEFAULT_SIZE,
+        help='Maximum number of positions to remember in the transposition table, '
+             'which avoids searching a position twice when it can be reached by '
+             'different orders of moves. 0 disables the table.')
+    parser.add_argument("--table-policy", choices=EVICTION_POLICIES, default='lru',
+        help='Which position to forget when the transposition table is full: '
+             'the least recently used (lru) or the oldest stored (fifo).')
+    parser.add_argument("--jobs", metavar='N', type=int, default=None,
+        help='Number of processes to search with (default: one per CPU). '
+             'With 1, the search runs entirely in the main process.')
+    parser.add_argument("--time-limit", metavar='SECONDS', type=float, default=None,
+        help='Stop searching each deal after this long and use the best line '
+             'found so far, which may not be the best possible.')
+    parser.add_argument("--max-nodes", metavar='N', type=int, default=None,
+        help='Stop searching each deal after trying this many legal permutations '
+             'of blocking moves and use the best line found so far.')
+    parser.add_argument("--no-por", dest='por', action='store_false', default=True,
+        help='Try every order of blocking moves that commute, rather than just '
+             'one (partial-order reduction). Slower, but useful for checking it.')
+
+
+def add_stats_option(parser: argparse.ArgumentParser, where: str) -> None:
+    parser.add_argument("--stats", metavar='FORMAT', choices=('json',), default=None,
+        help='Collect metrics about each deal\'s search (nodes searched by depth, '
+             'branching factor, time spent in each phase, nodes searched by each '
+             f'process, peak memory use) and write them {where}. '
+             'The only FORMAT is json.')
+
+
+def add_cache_options(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--cache", metavar='PATH', default=None,
+        help='Keep the best line for each deal solved in an SQLite database at '
+             'PATH, and look deals up there before searching them. Positions '
+             'that differ only in the order of their fans or the names of their '
+             'suits share a result. See "lbl cache-stats --help".')
+    parser.add_argument("--cache-size", metavar='N', type=int, default=DEFAULT_CACHE_SIZE,
+        help='Maximum number of results to keep in the cache; the least recently '
+             f'used are dropped to make room (default: {DEFAULT_CACHE_SIZE}).')
+
+
+def open_cache_or_exit(args) -> Optional[SolutionCache]:
+    "Open the cache at args.cache, if any, exiting with an error if it can't be used."
+    if args.cache is None:
+        return None
+    try:
+        return SolutionCache(args.cache, args.cache_size)
+    except sqlite3.Error as e:
+        sys.stderr.write(f"Oops! Unable to open the cache {args.cache}: {e}\n")
+        sys.exit(255)
+
+
+def batch_main() -> NoReturn:
+    parser = argparse.ArgumentParser(prog='lbl batch',
+        description='Solve many La Belle Lucie positions, one per line, writing '
+                    'a JSON record for each to standard output as it is solved.')
+    parser.add_argument("input", metavar='FILE', nargs='?', default='-',
+        help="File of positions to solve (default: standard input). Each line is "
+             "either a position with its fans separated by '/', like "
+             "'KH 2S 8S / 3S 5S QH / ...', or a JSON object with an optional "
+             "\"id\" and a \"position\" in that form or a list of \"fans\".")
+    add_rule_options(parser)
+    parser.add_argument("--seed", metavar='S', default=None,
+        help='Seed the shuffles for --redeal, so a batch gives the same results '
+             'each time it is run, however the positions are shared among processes.')
+    add_search_options(parser)
+    add_stats_option(parser, 'in each record as a list with an entry per deal')
+    add_cache_options(parser)
+    args = parser.parse_args(sys.argv[2:])
+    # Report a bad cache before starting the workers, which open their own.
+    cache = open_cache_or_exit(args)
+    if cache is not None:
+        cache.close()
+    sys.exit(run_batch(args))
+
+
+def add_first_option(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--first", metavar='N', type=int, default=0,
+        help='Number of the first game to deal (default: 0). Each game is dealt '
+             'from the seed and its number alone, so a long run can be split '
+             'into ranges of games on several machines.')
+
+
+def simulate_main() -> NoReturn:
+    parser = argparse.ArgumentParser(prog='lbl simulate',
+        description='Estimate how often La Belle Lucie can be won under the '
+                    'given rules by dealing and solving many random games.')
+    parser.add_argument("--games", metavar='N', type=int, default=100,
+        help='Number of games to play (default: 100).')
+    parser.add_argument("--seed", metavar='S', default=None,
+        help='Seed for dealing the games. The same seed and options always '
+             'give the same games and results, whatever the number of processes. '
+             'By default, a random seed is chosen and printed.')
+    add_first_option(parser)
+    add_rule_options(parser)
+    add_search_options(parser)
+    args = parser.parse_args(sys.argv[2:])
+    sys.exit(run_simulation(args))
+
+
+def bench_main() -> NoReturn:
+    parser = argparse.ArgumentParser(prog='lbl bench',
+        description='Time the search on a fixed corpus of positions and compare '
+                    'the results to a stored baseline, exiting with status 1 if '
+                    'the search got slower or found worse lines.')
+    parser.add_argument("--corpus", metavar='FILE', default=DEFAULT_CORPUS,
+        help='Positions to benchmark, one JSON object per line '
+             '(default: the corpus installed with lblsolve).')
+    parser.add_argument("--baseline", metavar='FILE', default=DEFAULT_BASELINE,
+        help='Baseline results to compare to (default: the baseline installed with '
+             'lblsolve).')
+    parser.add_argument("--save-baseline", action='store_true', default=False,
+        help='Store the results as the new baseline instead of comparing them.')
+    parser.add_argument("--check-por", action='store_true', default=False,
+        help='Instead of timing, solve each position with and without partial-'
+             'order reduction (see --no-por) and exit with status 1 if the best '
+             'foundation count differs for any of them.')
+    parser.add_argument("--category", metavar='NAME', action='append', default=None,
+        help='Only benchmark positions in this category (easy, hard, or merci '
+             'in the standard corpus). May be given more than once.')
+    parser.add_argument("--repeat", metavar='N', type=int, default=3,
+        help='Solve each position N times and take the fastest time (default: 3).')
+    parser.add_argument("--time-tolerance", metavar='FRACTION', type=float, default=0.25,
+        help='Count a position as slower only if its time rose by more than this '
+             'fraction (default: 0.25).')
+    parser.add_argument("--node-tolerance", metavar='FRACTION', type=float, default=0.0,
+        help='Count a position as a regression if the legal permutations searched '
+             'rose by more than this fraction (default: 0, since the count '
+             'is the same on every run).')
+    parser.add_argument("--min-time", metavar='SECONDS', type=float, default=0.01,
+        help='Ignore time differences smaller than this (default: 0.01).')
+    args = parser.parse_args(sys.argv[2:])
+    assert args.repeat >= 1, "--repeat must be at least 1"
+    sys.exit(run_bench(args))
+
+
+def autoplay_main() -> NoReturn:
+    parser = argparse.ArgumentParser(prog='lbl autoplay',
+        description='Deal many random games, the same ones "lbl simulate" would, '
+                    'and make only the automatic moves (foundation moves and safe '
+                    'builds) in all of them at once, to see how often a deal is '
+                    'cleared without any blocking moves and how far deals get '
+                    'before the first one. Requires NumPy.')
+    parser.add_argument("--games", metavar='N', type=int, default=10000,
+        help='Number of games to deal (default: 10000).')
+    parser.add_argument("--seed", metavar='S', default=None,
+        help='Seed for dealing the games, as for "lbl simulate". By default, '
+             'a random seed is chosen and printed.')
+    add_first_option(parser)
+    parser.add_argument("--check", action='store_true', default=False,
+        help='Also make the automatic moves of every game one at a time, the way '
+             'the solver does, and exit with status 1 if any result differs.')
+    args = parser.parse_args(sys.argv[2:])
+    try:
+        from .autoplay import run_autoplay
+    except ImportError as e:
+        sys.stderr.write(f"Oops! lbl autoplay requires NumPy "
+                         f"(pip install lblsolve[numpy]): {e}\n")
+        sys.exit(255)
+    sys.exit(run_autoplay(args))
+
+
+def deal_main() -> NoReturn:
+    parser = argparse.ArgumentParser(prog='lbl deal',
+        description='Write the starting positions of games dealt by "lbl simulate" '
+                    'or "lbl autoplay" with the given seed, one per line, so any '
+                    'of them can be solved or looked at on its own.')
+    parser.add_argument("--seed", metavar='S', required=True,
+        help='The seed the games were dealt with.')
+    add_first_option(parser)
+    parser.add_argument("--games", metavar='N', type=int, default=1,
+        help='Number of games to write (default: 1).')
+    parser.add_argument("--compact", action='store_true', default=False,
+        help='Write the positions in the compact form (see "lbl convert --help").')
+    args = parser.parse_args(sys.argv[2:])
+    fmt = format_compact if args.compact else format_line
+    for index in range(args.first, args.first + args.games):
+        print(fmt(deal_game(game_rng(args.seed, index))))
+    sys.exit(0)
+
+
+def convert_main() -> NoReturn:
+    parser = argparse.ArgumentParser(prog='lbl convert',
+        description='Rewrite a file of positions, one per line, in the compact '
+                    'one-line form (70 characters for a full deal), or back to '
+                    'the long form. The file is read and written a line at a '
+                    'time, so it can be any size.')
+    parser.add_argument("input", metavar='FILE', nargs='?', default='-',
+        help="File of positions to convert (default: standard input), in any "
+             "form 'lbl batch' reads without JSON. Blank lines and lines starting "
+             "with '#' are skipped.")
+    parser.add_argument("--to", choices=('compact', 'text'), default='compact',
+        help="Form to write: compact (the default) or text, with fans "
+             "separated by '/'.")
+    args = parser.parse_args(sys.argv[2:])
+    sys.exit(run_convert(args))
+
+
+def cache_stats_main() -> NoReturn:
+    parser = argparse.ArgumentParser(prog='lbl cache-stats',
+        description='Show how big a solution cache made with --cache is '
+                    'and how often it has saved a search.')
+    parser.add_argument("cache", metavar='PATH', help='The cache database.')
+    parser.add_argument("--clear", action='store_true', default=False,
+        help='Remove every result from the cache and reset its counters.')
+    args = parser.parse_args(sys.argv[2:])
+    if not os.path.exists(args.cache):
+        sys.stderr.write(f"Oops! There is no cache at {args.cache}.\n")
+        sys.exit(255)
+    args.cache_size = DEFAULT_CACHE_SIZE
+    with open_cache_or_exit(args) as cache:
+        if args.clear:
+            cache.clear()
+        print(cache.report())
+    sys.exit(0)
+
+
+def main() -> NoReturn:
+    if sys.argv[1:2] == ['batch']:
+        batch_main()
+    elif sys.argv[1:2] == ['simulate']:
+        simulate_main()
+    elif sys.argv[1:2] == ['bench']:
+        bench_main()
+    elif sys.argv[1:2] == ['cache-stats']:
+        cache_stats_main()
+    elif sys.argv[1:2] == ['convert']:
+        convert_main()
+    elif sys.argv[1:2] == ['autoplay']:
+        autoplay_main()
+    elif sys.argv[1:2] == ['deal']:
+        deal_main()
+
+    parser = argparse.ArgumentParser(
+        description='Solve La Belle Lucie solitaire games. '
+                    'See also "lbl batch --help" for solving many positions at once '
+                    '"lbl simulate --help" for estimating win rates, '
+                    '"lbl autoplay --help" for statistics on automatic moves alone, '
+                    '"lbl deal --help" for dealing the games of a simulation again, '
+                    '"lbl bench --help" for benchmarking the solver, '
+                    '"lbl cache-stats --help" for the solution cache, '
+                    'and "lbl convert --help" for the compact position form.')
+    add_rule_options(parser)
     parser.add_argument("--shuffle", action='store_true', default=False,
         help='Rather than taking an initial position on stdin, generate a random one.')
+    add_search_options(parser)
+    parser.add_argument("--split-depth", metavar='N', type=int, default=2,
+        help='Split the search tree into subtrees this many blocking moves '
+             'deep, to be shared out among the processes as they become idle.')
+    add_stats_option(parser, 'to standard error, one line per deal')
+    add_cache_options(parser)
+    parser.add_argument("--redeal-candidates", metavar='K', type=int, default=0,
+        help='With --redeal, end each deal but the last in whichever of the K '
+             'end states with the most cards on the foundation most often leads '
+             'to a win after the redeal, as estimated by solving sampled redeals '
+             'from each, rather than just the one with the most cards.')
+    parser.add_argument("--redeal-samples", metavar='N', type=int, default=100,
+        help='Number of redeals to sample from each candidate end state '
+             '(default: 100).')
+    parser.add_argument("--redeal-budget", metavar='SECONDS', type=float, default=None,
+        help='Stop looking for candidate end states and sampling redeals after '
+             'this long, and choose from the samples finished so far.')
+    parser.add_argument("--redeal-seed", metavar='S', default=None,
+        help='Seed for the sampled redeals, so the same end state is chosen '
+             'each time. (The redeals actually played are still random.)')
+    parser.add_argument("--load", metavar='FILE',
+        help='Rather than taking an initial position on stdin, read one saved '
+             'with --save.')
+    parser.add_argument("--save", metavar='FILE',
+        help='Save the initial position to FILE in a compact binary form '
+             'that can be read back with --load.')
 
     args = parser.parse_args()
 
-    deck = Deck()
     if args.shuffle:
+        deck = Deck()
         deck.fill()
         deck.shuffle()
-        play_game(args, deck)
+        tableau = Tableau()
+        tableau.deal(deck)
+        found = Foundations()
+    elif args.load:
+        try:
+            tableau, found = load_position(args.load)
+        except (OSError, ValueError) as e:
+            sys.stderr.write(f"Oops! Unable to load a position from {args.load}: {e}\n")
+            sys.exit(255)
     else:
         #TODO: This isn't going to work for a mid-game position:
         # we should parse to a tableau rather than to a deck.
         tableau, found = parse_position()
-        play_game(args, tableau=tableau, found=found)
+
+    if args.save:
+        save_position(args.save, tableau, found)
+    play_game(args, tableau, found)
 
 
 if __name__ == '__main__':
     main()
-
-# TODO: Is there a way to early break when it finds a complete solution? Not really any reason to continue searching at that point.
@@ -1,4 +1,12 @@
+import sys
 import time
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
 
 class Stopwatch:
     def __init__(self):
@@ -10,3 +18,123 @@ class Stopwatch:
         self.running_time += stopped - self.mark
         self.mark = stopped
 
+
+class SearchStats:
+    """
+    Counters describing the work a search did, kept only when asked for
+    (see SearchContext), since keeping them costs a little on every node:
+
+    * /nodes_by_depth/: legal permutations searched, by the number of
+      blocking moves before them.
+    * /positions/ and /children/: positions whose legal moves were generated,
+      and how many legal moves they had between them.
+    * /leaves/: positions reached with no legal moves left.
+    * /automatic_moves/: automatic moves made after blocking moves.
+    * /phase_time/: seconds spent generating moves, making automatic moves,
+      and replaying the best line once the search is over.
+    * /merci_candidates/: distinct positions mercis led to (see
+      solve.search_mercis()).
+    * /mercis/: for each of those searched, the merci's notation, the
+      blocking moves before it, the foundation count of the best line after
+      it (None if cut off), and the legal permutations and seconds searched.
+    * /workers/: for each process that searched, the nodes it searched,
+      the seconds it spent doing so, and its peak resident set size.
+    * /peak_rss/: the peak resident set size of the process that started
+      the search, once it has finished (see peak_rss()).
+    """
+    PHASES = ('movegen', 'automatic', 'replay')
+
+    def __init__(self) -> None:
+        self.nodes_by_depth: List[int] = []
+        self.positions = 0
+        self.children = 0
+        self.leaves = 0
+        self.automatic_moves = 0
+        self.merci_candidates = 0
+        self.mercis: List[list] = []
+        self.phase_time: Dict[str, float] = dict.fromkeys(self.PHASES, 0.0)
+        self.workers: Dict[str, List] = {}
+        self.peak_rss: Optional[int] = None
+
+    @property
+    def nodes(self) -> int:
+        return sum(self.nodes_by_depth)
+
+    @property
+    def branching_factor(self) -> float:
+        "The mean number of legal moves at a position that has any."
+        return self.children / self.positions if self.positions else 0.0
+
+    def count_node(self, depth: int) -> None:
+        "Count one legal permutation searched at /depth/."
+        if depth >= len(self.nodes_by_depth):
+            self.nodes_by_depth.extend([0] * (depth + 1 - len(self.nodes_by_depth)))
+        self.nodes_by_depth[depth] += 1
+
+    def add_time(self, phase: str, start: float) -> None:
+        "Add the time since /start/ (from time.perf_counter()) to /phase/."
+        self.phase_time[phase] += time.perf_counter() - start
+
+    def add_worker(self, worker: str, nodes: int, seconds: float,
+                   rss: Optional[int] = None) -> None:
+        """
+        Record that /worker/ searched /nodes/ nodes in /seconds/, with a peak
+        resident set size of /rss/ bytes so far, if known.
+        """
+        totals = self.workers.setdefault(worker, [0, 0.0, None])
+        totals[0] += nodes
+        totals[1] += seconds
+        if rss is not None:
+            totals[2] = max(totals[2] or 0, rss)
+
+    def merge(self, other: 'SearchStats') -> None:
+        "Add the counters from /other/ (e.g., a worker's) to this object's."
+        missing = len(other.nodes_by_depth) - len(self.nodes_by_depth)
+        if missing > 0:
+            self.nodes_by_depth.extend([0] * missing)
+        for depth, nodes in enumerate(other.nodes_by_depth):
+            self.nodes_by_depth[depth] += nodes
+        self.positions += other.positions
+        self.children += other.children
+        self.leaves += other.leaves
+        self.automatic_moves += other.automatic_moves
+        self.merci_candidates += other.merci_candidates
+        self.mercis.extend(other.mercis)
+        for phase, seconds in other.phase_time.items():
+            self.phase_time[phase] += seconds
+        for worker, (nodes, seconds, rss) in other.workers.items():
+            self.add_worker(worker, nodes, seconds, rss)
+        if other.peak_rss is not None:
+            self.peak_rss = max(self.peak_rss or 0, other.peak_rss)
+
+    def to_dict(self) -> dict:
+        "Return the counters as a JSON-serializable dict."
+        return {
+            'nodes': self.nodes,
+            'nodes_by_depth': list(self.nodes_by_depth),
+            'branching_factor': round(self.branching_factor, 3),
+            'leaves': self.leaves,
+            'automatic_moves': self.automatic_moves,
+            'merci_candidates': self.merci_candidates,
+            'mercis': [{'merci': merci, 'depth': depth, 'foundation': count, 'nodes': nodes,
+                        'time': round(seconds, 6)}
+                       for merci, depth, count, nodes, seconds in self.mercis],
+            'phase_time': {phase: round(seconds, 6) for phase, seconds in self.phase_time.items()},
+            'workers': [{'worker': worker, 'nodes': nodes, 'time': round(seconds, 6),
+                         'nodes_per_sec': round(nodes / seconds, 1) if seconds else None,
+                         'peak_rss': rss}
+                        for worker, (nodes, seconds, rss) in sorted(self.workers.items())],
+            'peak_rss': self.peak_rss,
+        }
+
+
+def peak_rss() -> Optional[int]:
+    """
+    Return the peak resident set size of this process so far, in bytes, or
+    None if the platform can't tell us.
+    """
+    if resource is None:
+        return None
+    # Linux reports kilobytes; macOS reports bytes.
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
@@ -1,10 +1,9 @@
 from __future__ import annotations
 
-from copy import deepcopy
 from itertools import zip_longest
-from typing import Dict, List, Iterable, Iterator, Optional, Sequence
+from typing import List, Iterable, Iterator, Optional, Sequence, Tuple
 
-from .card import Card, Deck, SUIT_GLYPHS
+from .card import CARDS, Card, Deck, SUITS, SUIT_GLYPHS
 
 
 
@@ -28,6 +27,10 @@ class Fan:
     becomes boolean false. Users of the fan are expected to check this after
     removing cards and delete their references to the fan if it has become
     empty.
+
+    Once a fan is added to a Tableau, it keeps the tableau's TableauIndex up
+    to date as cards are added and removed, so its cards should only be
+    changed through its methods.
     """
     def __init__(self, cards: Sequence[Card]) -> None:
         """
@@ -38,6 +41,7 @@ class Fan:
         """
         self.cards = []
         self.cards.extend(cards)
+        self.index: Optional[TableauIndex] = None
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, Fan):
@@ -80,9 +84,37 @@ class Fan:
         must ensure the specified card actually exists in the fan.
         """
         if card:
-            return self.cards.pop(self.cards.index(card))
+            return self.remove_at(self.cards.index(card))
         else:
-            return self.cards.pop()
+            return self.remove_at(len(self.cards) - 1)
+
+    def remove_at(self, position: int) -> Card:
+        "Remove and return the card at /position/ (0 is the bottom)."
+        cards = self.cards
+        card = cards.pop(position)
+        index = self.index
+        if index is not None:
+            index.fan_of[card.id] = None
+            if position == len(cards):
+                index.unwant(card)
+                if cards:
+                    index.want(cards[-1], self)
+        return card
+
+    def insert_at(self, position: int, card: Card) -> None:
+        """
+        Put /card/ back at /position/ (0 is the bottom), undoing remove_at().
+        No check is made that this is legal.
+        """
+        cards = self.cards
+        index = self.index
+        if index is not None:
+            index.fan_of[card.id] = self
+            if position == len(cards):
+                if cards:
+                    index.unwant(cards[-1])
+                index.want(card, self)
+        cards.insert(position, card)
 
     def can_push(self, card: Card) -> bool:
         """
@@ -92,10 +124,8 @@ class Fan:
         if not self:
             # We can never build on an empty fan.
             return False
-        if not card.after():
-            # We can never build a king on anything.
-            return False
-        return self.top() == card.after()
+        # We can never build a king on anything (its after() is None).
+        return self.cards[-1] is card.after()
 
     def push(self, card: Card) -> None:
         """
@@ -103,7 +133,7 @@ class Fan:
         is pushable.
         """
         assert self.can_push(card), f"{card} {card.after()} {self.top()} {self}"
-        self.cards.append(card)
+        self.insert_at(len(self.cards), card)
 
     def safe_build(self, card: Card) -> bool:
         """
@@ -133,7 +163,7 @@ class Fan:
             # We can safely build if the top card is a king
             # (it can only be moved onto foundation anyway).
             return True
-        elif self.cards[-1].after() == self.cards[-2]:
+        elif self.cards[-1].after() is self.cards[-2]:
             # We can safely build if a descending run sits atop the stack
             # (the stack can only be moved onto foundation anyway).
             return True
@@ -145,34 +175,79 @@ class Foundations:
     """
     The Foundations are a set of stacks built up from ace to king. You win the game
     by moving all cards on the tableau onto such stacks.
+
+    Since each pile holds the cards of its suit in order, only the height of
+    each pile is stored (in the order of SUITS); the cards are implied.
     """
     def __init__(self):
-        self.founds: Dict[List[Card]] = {}
+        self.heights: List[int] = [0] * len(SUITS)
+        self._count = 0
 
     def __repr__(self) -> str:
         result = []
-        for k, v in self.founds.items():
-            result.append(f"[{SUIT_GLYPHS[k]}] " + (" ".join(repr(i) for i in v)))
+        for suit_idx, (suit, height) in enumerate(zip(SUITS, self.heights)):
+            if height:
+                cards = CARDS[suit_idx * 13:suit_idx * 13 + height]
+                result.append(f"[{SUIT_GLYPHS[suit]}] " + (" ".join(repr(i) for i in cards)))
         return '\n'.join(result)
 
     def __len__(self) -> int:
-        return sum(len(v) for v in self.founds.values())
+        return self._count
+
+    def key(self) -> tuple:
+        "Return a hashable value identifying the height of each foundation pile."
+        return tuple(self.heights)
+
+    def copy(self) -> Foundations:
+        "Return an independent copy of the foundations."
+        return Foundations.from_heights(self.heights)
+
+    @classmethod
+    def from_heights(cls, heights: Sequence[int]) -> Foundations:
+        """
+        Create a Foundations object from the number of cards on each pile,
+        in the order of SUITS (the inverse of key()).
+        """
+        found = cls()
+        found.heights = list(heights)
+        found._count = sum(found.heights)
+        return found
 
     @classmethod
     def infer(cls, tableau: Tableau) -> Foundations:
         """
         Create a Foundations object containing all cards that are *not* in the
         provided tableau.
-        """
-        found = cls()
-        tableau_cards = [c for fan in tableau.fans for c in fan]
-        deck = Deck()
-        deck.fill()
 
-        for c in deck:
-            if c not in tableau_cards:
-                found.insert(c)
-        return found
+        Raise ValueError if that isn't a position that can occur in a game:
+        if a card is on the tableau twice, or if the missing cards of a suit
+        aren't all the lowest ones (e.g., A♦ and 3♦ are missing, but the 2♦
+        is on the tableau).
+        """
+        on_tableau = [False] * len(CARDS)
+        for fan in tableau.fans:
+            for card in fan:
+                if on_tableau[card.id]:
+                    raise ValueError(f"The {card} appears on the tableau twice.")
+                on_tableau[card.id] = True
+
+        heights = []
+        for suit_idx, suit in enumerate(SUITS):
+            suit_cards = on_tableau[suit_idx * 13:suit_idx * 13 + 13]
+            height = suit_cards.index(True) if True in suit_cards else 13
+            if not all(suit_cards[height:]):
+                gap = CARDS[suit_idx * 13 + suit_cards.index(False, height)]
+                raise ValueError(
+                    f"The {gap} is not on the tableau, so it would have to be on the "
+                    f"foundation, but the {CARDS[suit_idx * 13 + height]} is on the "
+                    f"tableau, so it can't be.")
+            heights.append(height)
+        return cls.from_heights(heights)
+
+    def next_cards(self) -> List[Card]:
+        "Return the card that can go on each foundation pile next (if any)."
+        return [CARDS[suit_idx * 13 + height]
+                for suit_idx, height in enumerate(self.heights) if height < 13]
 
     def can_insert(self, card: Card) -> bool:
         """
@@ -181,34 +256,75 @@ class Foundations:
         * It is an ace (aces start new foundation piles when moved).
         * One of the foundation piles contains the card immediately before it.
         """
-        if card.suit not in self.founds and card.num == 1:
-            return True
-        elif card.suit in self.founds and self.founds[card.suit][-1] == card.before():
-            return True
-        else:
-            return False
-    
+        return self.heights[card.id // 13] == card.id % 13
+
     def insert(self, card: Card) -> bool:
         """
         Try to insert a card into the foundations. Return True if successful,
         False if it was not possible to insert.
         """
-        if not self.can_insert(card):
+        suit_idx, offset = divmod(card.id, 13)
+        if self.heights[suit_idx] != offset:
             return False
-        if card.suit not in self.founds:
-            self.founds[card.suit] = [card]
-        else:
-            self.founds[card.suit].append(card)
+        self.heights[suit_idx] += 1
+        self._count += 1
         return True
 
+    def pop(self, suit: str) -> Card:
+        """
+        Remove and return the top card of the foundation pile for /suit/.
+        This is never a legal move; it's used to undo insert().
+        """
+        suit_idx = SUITS.index(suit)
+        self.heights[suit_idx] -= 1
+        self._count -= 1
+        return CARDS[suit_idx * 13 + self.heights[suit_idx]]
+
+
+class TableauIndex:
+    """
+    Lookups kept up to date by the fans of a Tableau as cards move: the fan
+    each card is in, and the fan (if any) each card can be built onto, i.e.,
+    the fan whose top card is its successor. Both are lists indexed by card id.
+    """
+    __slots__ = ('fan_of', 'wanted_by')
+
+    def __init__(self) -> None:
+        self.fan_of: List[Optional[Fan]] = [None] * 52
+        self.wanted_by: List[Optional[Fan]] = [None] * 52
+
+    def attach(self, fan: Fan) -> None:
+        "Start keeping track of the cards in /fan/."
+        fan.index = self
+        for card in fan.cards:
+            self.fan_of[card.id] = fan
+        if fan.cards:
+            self.want(fan.cards[-1], fan)
+
+    def want(self, top: Card, fan: Fan) -> None:
+        "Record that /top/ is now the top card of /fan/."
+        wanted = top.before()
+        if wanted is not None:
+            self.wanted_by[wanted.id] = fan
+
+    def unwant(self, top: Card) -> None:
+        "Record that /top/ is no longer the top card of a fan."
+        wanted = top.before()
+        if wanted is not None:
+            self.wanted_by[wanted.id] = None
+
 
 class Tableau:
     """
     The tableau for La Belle Lucie consists of a series of Fans. See that class
     for details on the allowable moves, etc.
+
+    Fans should be added with add_fan() (or deal()), so that the tableau's
+    TableauIndex keeps track of them.
     """
     def __init__(self):
         self.fans: List[Fan] = []
+        self.index = TableauIndex()
 
     def __repr__(self) -> str:
         result = []
@@ -233,7 +349,12 @@ class Tableau:
             for _ in range(3):
                 if deck:
                     next_fan_cards.append(deck.draw())
-            self.fans.append(Fan(next_fan_cards))
+            self.add_fan(Fan(next_fan_cards))
+
+    def add_fan(self, fan: Fan) -> None:
+        "Add /fan/ to the right of the tableau."
+        self.fans.append(fan)
+        self.index.attach(fan)
 
     def fan(self, index: int) -> Fan:
         "Return the Fan at the specified index."
@@ -244,10 +365,7 @@ class Tableau:
         Find and return the Fan that contains the specified Card,
         or None in the card isn't in the tableau.
         """
-        for fan in self.fans:
-            if card in fan:
-                return fan
-        return None
+        return self.index.fan_of[card.id]
 
     def gather(self) -> List[Card]:
         """
@@ -256,6 +374,7 @@ class Tableau:
         """
         L = [i for fan in self.fans for i in fan]
         self.fans.clear()
+        self.index = TableauIndex()
         return L
 
     def movable_cards(self) -> Iterable[Card]:
@@ -281,61 +400,198 @@ class Tableau:
         moves.
         """
         legal_moves = []
-        for card in self.movable_cards():
-            for idx, target_fan in enumerate(self.fans):
-                if target_fan.can_push(card):
-                    legal_moves.append(Move(card, target_fan, idx))
+        wanted_by = self.index.wanted_by
+        positions = None
+        for fan in self.fans:
+            card = fan.cards[-1]
+            target_fan = wanted_by[card.id]
+            if target_fan is not None:
+                if positions is None:
+                    positions = {id(f): idx for idx, f in enumerate(self.fans)}
+                legal_moves.append(Move(card, positions[id(target_fan)]))
 
         if merci:
             assert foundation is not None  # only required for merci moves
-            for card in self.immovable_cards():
-                if foundation.can_insert(card):
-                    legal_moves.append(Move(card, is_merci=True))
-
-                for idx, target_fan in enumerate(self.fans):
-                    if target_fan.can_push(card):
-                        legal_moves.append(Move(card, target_fan, idx, is_merci=True))
+            legal_moves.extend(self.merci_moves(foundation))
 
         return legal_moves
 
+    def merci_moves(self, foundation: Foundations) -> List[Move]:
+        "Return a list of the mercis possible on the current tableau."
+        mercis = []
+        wanted_by = self.index.wanted_by
+        positions = None
+        for card in self.immovable_cards():
+            if foundation.can_insert(card):
+                mercis.append(Move(card, is_merci=True))
+
+            target_fan = wanted_by[card.id]
+            if target_fan is not None:
+                if positions is None:
+                    positions = {id(f): idx for idx, f in enumerate(self.fans)}
+                mercis.append(Move(card, positions[id(target_fan)], is_merci=True))
+        return mercis
+
 
 class Move:
+    """
+    A move of /card/ onto the fan at /target_fan_index/ in the tableau, or
+    to the foundation if that's None; /is_merci/ and /is_safe/ mark mercis
+    and safe builds.
+
+    The search creates a Move for every legal move it considers, so a Move
+    holds no more than that. Printing a move shows the fan it went onto as
+    it was at the time, which is only known once describe() has recorded it
+    (see solve.describe_moves()); until then, only the fan's top card is
+    shown.
+    """
+    __slots__ = ('card', 'target_fan_index', 'is_merci', 'is_safe', 'target_fan')
+
     def __init__(self,
                  card: Card,
-                 target_fan: Optional[Fan] = None,
                  target_fan_index: Optional[int] = None,
                  is_merci: bool = False,
                  is_safe: bool = False) -> None:
         self.card = card
-        if target_fan is not None:  # None = foundation move
-            self.target_fan = deepcopy(target_fan)
-        else:
-            self.target_fan = None
         self.target_fan_index = target_fan_index
         self.is_merci = is_merci
         self.is_safe = is_safe
+        self.target_fan: Optional[Fan] = None
 
     @property
-    def is_foundation_move(self):
-        return self.target_fan is None
+    def is_foundation_move(self) -> bool:
+        return self.target_fan_index is None
+
+    def describe(self, tableau: Tableau) -> None:
+        """
+        Record a copy of the fan this move goes onto, as it is on /tableau/
+        before the move is made, for printing.
+        """
+        if not self.is_foundation_move:
+            # A copy, so it isn't indexed and later moves don't change it.
+            self.target_fan = Fan(tableau.index.wanted_by[self.card.id].cards)
 
     def __str__(self) -> str:
+        target = self.target_fan if self.target_fan is not None else self.card.after()
         if self.is_merci and self.is_foundation_move:
             return f"[Merci          ] {self.card} => foundation"
         elif self.is_merci:
-            return f"[Merci          ] {self.card} => {self.target_fan}"
+            return f"[Merci          ] {self.card} => {target}"
         elif self.is_foundation_move:
             return f"[Foundation move] {self.card}"
         elif self.is_safe:
-            return f"[Safe build     ] {self.card} => {self.target_fan}"
+            return f"[Safe build     ] {self.card} => {target}"
         else:
-            return f"[Blocking move  ] {self.card} => {self.target_fan}"
+            return f"[Blocking move  ] {self.card} => {target}"
 
-    def apply(self, tableau: Tableau, foundation: Foundations) -> None:
+    def notation(self) -> str:
+        """
+        A short plain-ASCII description of the move: a letter for the kind of
+        move (B for a blocking move, S for a safe build, F for a foundation
+        move, M for a merci), then the card and where it went ('F' for the
+        foundation), e.g., "B:10D>JD" or "F:AS>F".
+        """
+        if self.is_merci:
+            kind = 'M'
+        elif self.is_foundation_move:
+            kind = 'F'
+        elif self.is_safe:
+            kind = 'S'
+        else:
+            kind = 'B'
+        target = 'F' if self.is_foundation_move else self.card.after().text
+        return f"{kind}:{self.card.text}>{target}"
+
+    def apply(self, tableau: Tableau, foundation: Foundations,
+              log: Optional[ChangeLog] = None) -> None:
         """
         Perform the move identified in the stack on the given tableau and foundation.
+        If a ChangeLog is provided, the change is recorded there so it can be undone.
         """
+        if log is None:
+            log = ChangeLog()
         if self.is_foundation_move:
-            foundation.insert(self.card)
+            log.insert(foundation, self.card)
         else:
-            tableau.fan(self.target_fan_index).push(self.card)
+            log.push(tableau.fan(self.target_fan_index), self.card)
+
+
+class ChangeLog:
+    """
+    A record of changes made in place to a tableau and foundation, which can
+    be undone to return to an earlier position.
+
+    The search uses this to try a move and everything that follows from it
+    on a single tableau and foundation, then back it out before trying the
+    next move, rather than working on a fresh copy of the whole position for
+    every move. Making a change through the log costs the same as making it
+    directly; undoing it costs the same again.
+    """
+    POP, PUSH, INSERT, FANS = range(4)
+
+    def __init__(self) -> None:
+        self._entries: List[tuple] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def mark(self) -> int:
+        "Return a marker for the current position, to be passed to undo() later."
+        return len(self._entries)
+
+    def pop(self, fan: Fan, card: Card = None) -> Card:
+        "Like Fan.pop(), but recorded."
+        index = len(fan) - 1 if card is None else fan.cards.index(card)
+        card = fan.remove_at(index)
+        self._entries.append((self.POP, fan, index, card))
+        return card
+
+    def push(self, fan: Fan, card: Card) -> None:
+        "Like Fan.push(), but recorded."
+        fan.push(card)
+        self._entries.append((self.PUSH, fan))
+
+    def insert(self, foundation: Foundations, card: Card) -> bool:
+        "Like Foundations.insert(), but recorded."
+        if not foundation.insert(card):
+            return False
+        self._entries.append((self.INSERT, foundation, card.suit))
+        return True
+
+    def teardown(self, tableau: Tableau) -> None:
+        "Like Tableau.teardown_empty_fans(), but recorded."
+        if all(tableau.fans):
+            return
+        self._entries.append((self.FANS, tableau, tableau.fans))
+        tableau.teardown_empty_fans()
+
+    def changes_since(self, mark: int) -> Tuple[List[Fan], List[Card]]:
+        """
+        Return the fans that cards have been removed from or added to since
+        mark() returned /mark/, and the cards that have been moved.
+        """
+        fans, cards = [], []
+        for entry in self._entries[mark:]:
+            if entry[0] == self.POP:
+                fans.append(entry[1])
+                cards.append(entry[3])
+            elif entry[0] == self.PUSH:
+                fans.append(entry[1])
+        return fans, cards
+
+    def undo(self, mark: int) -> None:
+        "Undo all changes recorded since mark() returned /mark/, most recent first."
+        entries = self._entries
+        while len(entries) > mark:
+            entry = entries.pop()
+            kind = entry[0]
+            if kind == self.POP:
+                _, fan, index, card = entry
+                fan.insert_at(index, card)
+            elif kind == self.PUSH:
+                entry[1].pop()
+            elif kind == self.INSERT:
+                entry[1].pop(entry[2])
+            else:
+                # teardown_empty_fans() replaces the list rather than changing it.
+                entry[1].fans = entry[2]
@@ -0,0 +1,243 @@
+import json
+import re
+import sys
+from typing import IO, Iterable, Iterator, Optional, Sequence, Tuple, Union
+
+from .card import CARDS, Card
+from .lucie import Fan, Foundations, Tableau
+
+# The compact form of a position: COMPACT_PREFIX, then each fan as one
+# character per card (the card's id indexes COMPACT_ALPHABET: clubs A-M,
+# diamonds N-Z, hearts a-m, spades n-z), with the fans separated by
+# COMPACT_SEPARATOR.
+COMPACT_PREFIX = '='
+COMPACT_SEPARATOR = '.'
+COMPACT_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+# The card id of each character code in the compact form, or one of these.
+_INVALID, _FAN_END = -1, -2
+COMPACT_IDS = [_INVALID] * 128
+for _card_id, _char in enumerate(COMPACT_ALPHABET):
+    COMPACT_IDS[ord(_char)] = _card_id
+COMPACT_IDS[ord(COMPACT_SEPARATOR)] = _FAN_END
+
+FAN_SEPARATOR = re.compile("[/|]")
+LINE_OR_FAN_SEPARATOR = re.compile("[/|\n]")
+
+
+def parse_fan(text: str) -> Fan:
+    """
+    Read a fan from a string of cards separated by whitespace, like
+    "KH 2S 8S", bottom card first. Raise ValueError if anything on the
+    line isn't a valid card.
+    """
+    cards = []
+    for card_text in text.split():
+        card = Card.from_text(card_text)
+        if card is None:
+            raise ValueError(f"'{card_text}' doesn't appear to be a valid card.")
+        cards.append(card)
+    return Fan(cards)
+
+
+def position_from_fans(fans: Iterable[Fan]) -> Tuple[Tableau, Foundations]:
+    """
+    Build a tableau from a series of fans, with a foundation containing
+    every card that isn't on the tableau. Raise ValueError if there are no
+    cards or duplicate cards.
+    """
+    tableau = Tableau()
+    for fan in fans:
+        if fan:
+            tableau.add_fan(fan)
+    all_cards = [c for fan in tableau.fans for c in fan]
+
+    if not all_cards:
+        raise ValueError("No cards were entered on the tableau.")
+    if len(all_cards) != len(set(all_cards)):
+        raise ValueError("There appear to be duplicate cards in this tableau. "
+                         "Please check the tableau.")
+    return tableau, Foundations.infer(tableau)
+
+
+def parse_line(line: str) -> Tuple[Tableau, Foundations]:
+    """
+    Read a whole position from one line, with the fans separated by '/' or
+    '|', e.g., "KH 2S 8S / 3S 5S QH / ... / QS", or in the compact form
+    (see parse_compact()).
+    """
+    line = line.strip()
+    if line.startswith(COMPACT_PREFIX):
+        return parse_compact(line)
+    return position_from_fans(parse_fan(text) for text in FAN_SEPARATOR.split(line))
+
+
+def parse_compact(line: str) -> Tuple[Tableau, Foundations]:
+    """
+    Read a position written by format_compact(). As for
+    position_from_fans(), the foundation contains every card that isn't on
+    the tableau, and ValueError is raised if there are no cards, if a card
+    appears twice, or if the foundation couldn't hold the missing cards.
+
+    Each character is decoded by looking it up in a table, and the
+    duplicates and the foundation are worked out in the same pass, so
+    this is much faster than reading the long form.
+    """
+    line = line.strip()
+    if not line.startswith(COMPACT_PREFIX):
+        raise ValueError(f"A compact position must start with '{COMPACT_PREFIX}'.")
+    seen = bytearray(len(CARDS))
+    fans: list = []
+    fan: list = []
+    for char in line[len(COMPACT_PREFIX):]:
+        code = ord(char)
+        card_id = COMPACT_IDS[code] if code < 128 else _INVALID
+        if card_id >= 0:
+            if seen[card_id]:
+                raise ValueError(f"The {CARDS[card_id]} appears on the tableau twice.")
+            seen[card_id] = 1
+            fan.append(CARDS[card_id])
+        elif card_id == _FAN_END:
+            if fan:
+                fans.append(fan)
+                fan = []
+        else:
+            raise ValueError(f"'{char}' isn't a card in the compact form.")
+    if fan:
+        fans.append(fan)
+    if not fans:
+        raise ValueError("No cards were entered on the tableau.")
+
+    # Each suit's missing cards must be its lowest ones, so they can be on
+    # the foundation (see Foundations.infer()).
+    heights = []
+    for start in range(0, len(CARDS), 13):
+        suit = seen[start:start + 13]
+        height = suit.find(1)
+        if height == -1:
+            height = 13
+        elif 0 in suit[height:]:
+            raise ValueError(
+                f"The {CARDS[start + suit.index(0, height)]} is not on the tableau, "
+                f"so it would have to be on the foundation, but the "
+                f"{CARDS[start + height]} is on the tableau, so it can't be.")
+        heights.append(height)
+
+    tableau = Tableau()
+    for cards in fans:
+        tableau.add_fan(Fan(cards))
+    return tableau, Foundations.from_heights(heights)
+
+
+def read_position(position: Union[str, Sequence, Tableau]) -> Tuple[Tableau, Foundations]:
+    """
+    Read a position given in any of the ways a caller might have it: as
+    text with the fans on separate lines or separated by '/' or '|', or in
+    the compact form (see parse_compact()); as a list of fans, each a list
+    of cards like "KH" (or a string of cards); or as a Tableau (which is
+    copied, not used). The foundation contains every card that isn't on the
+    tableau. Raise ValueError if /position/ isn't a valid position.
+    """
+    if isinstance(position, str):
+        if position.strip().startswith(COMPACT_PREFIX):
+            return parse_compact(position.strip())
+        return position_from_fans(parse_fan(text)
+                                  for text in LINE_OR_FAN_SEPARATOR.split(position))
+    if isinstance(position, Tableau):
+        return position_from_fans(Fan(list(fan)) for fan in position.fans)
+    return position_from_fans(parse_fan(fan if isinstance(fan, str) else ' '.join(fan))
+                              for fan in position)
+
+
+def format_line(tableau: Tableau) -> str:
+    "Write a tableau in the one-line form parse_line() reads."
+    return ' / '.join(' '.join(c.text for c in fan) for fan in tableau.fans)
+
+
+def format_compact(tableau: Tableau) -> str:
+    """
+    Write a tableau in the compact one-line form parse_compact() reads: a
+    full deal takes 70 characters, e.g., "=mou.prl.kdW.PHU.DxT.ane...".
+    """
+    return COMPACT_PREFIX + COMPACT_SEPARATOR.join(
+        ''.join(COMPACT_ALPHABET[c.id] for c in fan) for fan in tableau.fans)
+
+
+def read_positions(stream: IO[str]) -> Iterator[Tuple[int, Tableau, Foundations]]:
+    """
+    Read the positions in /stream/, one per line in any form parse_line()
+    reads, yielding the line number, tableau, and foundation of each as it
+    is read, so a file of any size can be read in constant memory. Blank
+    lines and lines starting with '#' are skipped. Raise ValueError, naming
+    the line, if a line can't be read.
+    """
+    for line_num, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            yield (line_num, *parse_line(line))
+        except ValueError as e:
+            raise ValueError(f"Line {line_num}: {e}") from e
+
+
+def write_positions(stream: IO[str], tableaus: Iterable[Tableau],
+                    compact: bool = True) -> int:
+    """
+    Write each of /tableaus/ to /stream/ on its own line, in the compact
+    form (or the long form, if /compact/ is unset). Return the number of
+    positions written.
+    """
+    fmt = format_compact if compact else format_line
+    count = 0
+    for tableau in tableaus:
+        stream.write(fmt(tableau) + '\n')
+        count += 1
+    return count
+
+
+def parse_record(line: str) -> Tuple[Optional[str], Tableau, Foundations]:
+    """
+    Read a position from one line of a batch input file, returning an
+    identifier for the position (None if it has none), the tableau, and the
+    foundation.
+
+    The line is either a position in the form parse_line() reads, or a JSON
+    object with an optional "id" and either a "position" in that form or
+    "fans", a list of fans, each a list of cards (or a string of cards).
+    Raise ValueError if the line can't be read.
+    """
+    line = line.strip()
+    if not line.startswith('{'):
+        return (None, *parse_line(line))
+
+    record = json.loads(line)  # JSONDecodeError is a ValueError
+    if not isinstance(record, dict):
+        raise ValueError("Expected a JSON object.")
+    ident = record.get('id')
+    ident = None if ident is None else str(ident)
+    if 'position' in record:
+        return (ident, *parse_line(record['position']))
+    elif 'fans' in record:
+        return (ident, *read_position(record['fans']))
+    else:
+        raise ValueError("Expected a 'position' or 'fans' key.")
+
+
+def run_convert(args) -> int:
+    """
+    Rewrite every position in the file args.input (or standard input) to
+    standard output, in the compact form or, if args.to is 'text', the long
+    form, one at a time. Return the exit status: 0 if every line could be
+    read, 255 otherwise.
+    """
+    stream = open(args.input, encoding='utf-8') if args.input not in (None, '-') else sys.stdin
+    with stream:
+        try:
+            count = write_positions(sys.stdout, (tableau for _, tableau, _ in
+                                                 read_positions(stream)),
+                                    compact=args.to == 'compact')
+        except ValueError as e:
+            sys.stderr.write(f"Oops! {e}\n")
+            return 255
+    sys.stderr.write(f"Converted {count} position(s).\n")
+    return 0
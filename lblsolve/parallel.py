@@ -0,0 +1,168 @@
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+from multiprocessing import Value
+from typing import Callable, Iterable, Iterator, Optional
+
+from .transposition import DEFAULT_SIZE, TranspositionTable
+
+
+class WorkerState:
+    """
+    The state each worker process of a SearchPool keeps between tasks:
+    counters shared with the parent and the other workers, and the worker's
+    own transposition table, which lives as long as the worker does.
+    """
+    def __init__(self, num_moves, incumbent, stop,
+                 table: Optional[TranspositionTable]) -> None:
+        self.num_moves = num_moves
+        self.incumbent = incumbent
+        self.stop = stop
+        self.table = table
+
+
+_worker: Optional[WorkerState] = None
+_EXHAUSTED = object()
+
+
+def _init_worker(num_moves, incumbent, stop, table_size: int, table_policy: str) -> None:
+    global _worker
+    table = TranspositionTable(table_size, table_policy) if table_size > 0 else None
+    _worker = WorkerState(num_moves, incumbent, stop, table)
+
+
+def _init_worker_process(*args) -> None:
+    # Ctrl-C goes to every process in the terminal's process group; leave it
+    # to the parent to decide what to do (usually, set the stop flag).
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _init_worker(*args)
+
+
+def worker_state() -> WorkerState:
+    "Return the state of the worker process (or serial pool) we're running in."
+    assert _worker is not None, "Not running in a SearchPool worker."
+    return _worker
+
+
+class SearchPool:
+    """
+    A set of worker processes for searching, started once and reused for
+    every search (e.g., every deal of a game), so each search doesn't pay
+    to fork its own workers.
+
+    With /jobs/ set to 1, no processes are started at all: tasks run one
+    after another in this process. Otherwise /jobs/ processes are started
+    (by default, one per CPU); tasks are handed to whichever worker is idle.
+    """
+    def __init__(self, jobs: Optional[int] = None, table_size: int = DEFAULT_SIZE,
+                 table_policy: str = 'lru') -> None:
+        self.jobs = jobs or os.cpu_count() or 1
+        self.table_size = table_size
+        self.num_moves = Value('i', 0)
+        self.incumbent = Value('i', -1)
+        self.stop = Value('b', 0)
+        initargs = (self.num_moves, self.incumbent, self.stop, table_size, table_policy)
+        if self.jobs == 1:
+            self._pool = None
+            _init_worker(*initargs)
+        else:
+            self._pool = multiprocessing.Pool(self.jobs, initializer=_init_worker_process,
+                                              initargs=initargs)
+
+    def __enter__(self) -> 'SearchPool':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @property
+    def is_serial(self) -> bool:
+        return self._pool is None
+
+    def reset(self) -> None:
+        "Clear the shared counters and stop flag before starting a new search."
+        self.num_moves.value = 0
+        self.incumbent.value = -1
+        self.stop.value = 0
+
+    def imap_unordered(self, func: Callable, tasks: Iterable,
+                       window: Optional[int] = None) -> Iterator:
+        """
+        Run /func/ on each of /tasks/, yielding the results in the order
+        they finish. /func/ must be a module-level function.
+
+        Normally all the tasks are read up front. If /window/ is set, only
+        that many tasks are read ahead of the results that have been
+        consumed, so /tasks/ can be an arbitrarily long iterator.
+        """
+        if self._pool is None:
+            return map(func, tasks)
+        if window is None:
+            return self._pool.imap_unordered(func, tasks)
+        return self._imap_window(func, tasks, window)
+
+    def _imap_window(self, func: Callable, tasks: Iterable, window: int) -> Iterator:
+        finished: queue.Queue = queue.Queue()
+        tasks = iter(tasks)
+        in_flight = 0
+        exhausted = False
+        while True:
+            while not exhausted and in_flight < window:
+                task = next(tasks, _EXHAUSTED)
+                if task is _EXHAUSTED:
+                    exhausted = True
+                    break
+                self._pool.apply_async(func, (task,),
+                                       callback=lambda r: finished.put((True, r)),
+                                       error_callback=lambda e: finished.put((False, e)))
+                in_flight += 1
+            if not in_flight:
+                return
+            ok, result = finished.get()
+            in_flight -= 1
+            if not ok:
+                raise result
+            yield result
+
+    def close(self) -> None:
+        "Shut down the worker processes."
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
+class StopOnInterrupt:
+    """
+    A context manager in which Ctrl-C (SIGINT) sets the shared flag /stop/
+    instead of raising KeyboardInterrupt, so that a search can wind down and
+    return the best line it has found. /interrupted/ records whether that
+    happened. A second Ctrl-C raises KeyboardInterrupt as usual.
+
+    Nothing is changed if /enabled/ is False, if SIGINT isn't being handled
+    the usual way (e.g., in a worker process, which ignores it), or outside
+    the main thread.
+    """
+    def __init__(self, stop, enabled: bool = True) -> None:
+        self.stop = stop
+        self.enabled = enabled
+        self.interrupted = False
+        self._installed = False
+
+    def _handle(self, signum, frame) -> None:
+        self.interrupted = True
+        self.stop.value = 1
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+    def __enter__(self) -> 'StopOnInterrupt':
+        if (self.enabled and threading.current_thread() is threading.main_thread()
+                and signal.getsignal(signal.SIGINT) is signal.default_int_handler):
+            signal.signal(signal.SIGINT, self._handle)
+            self._installed = True
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._installed:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
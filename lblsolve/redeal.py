@@ -0,0 +1,161 @@
+import random
+import time
+from typing import Optional, Tuple
+
+from .card import Deck
+from .parallel import SearchPool, StopOnInterrupt, worker_state
+from .simulate import game_rng, wilson_interval
+from .solve import DealResult, deal_endings, solve_game
+from .state import pack, unpack
+
+
+def redeal_task(task: Tuple[int, int, bytes, object, dict]) -> Tuple[int, bool, int, float, bool]:
+    """
+    Gather, shuffle and redeal the cards left at one candidate end state of
+    a deal, and solve the rest of the game, in a SearchPool worker. Return
+    the candidate's index, whether the game was won, the number of blocking
+    moves searched, how long it took, and whether the pool's stop flag cut
+    the game short (so the result means nothing).
+
+    Sample number /sample/ is shuffled by the same random number generator
+    for every candidate, so the candidates are compared on the same shuffles
+    as far as their cards allow.
+    """
+    candidate, sample, packed, seed, options = task
+    start = time.perf_counter()
+    rng = game_rng(seed, sample)
+    tableau, found = unpack(packed)
+    deck = Deck()
+    deck.add_many(tableau.gather())
+    deck.shuffle(rng)
+    tableau.deal(deck)
+
+    # The pool's stop flag is only watched, not shared: a sample running out
+    # of its own time or nodes mustn't stop the others.
+    stop = worker_state().stop
+    result = solve_game(tableau, found, options['deal'], options['max_deal'], True,
+                        options['merci'], rng, table=worker_state().table,
+                        time_limit=options['time_limit'], max_nodes=options['max_nodes'],
+                        por=options['por'], handle_interrupt=False, abort=stop)
+    return (candidate, result.solved, sum(deal.num_moves for deal in result.deals),
+            time.perf_counter() - start, bool(stop.value))
+
+
+class RedealEstimate:
+    """
+    Tallies the sampled redeals from one candidate end state of a deal,
+    /result/, as they come in.
+    """
+    def __init__(self, result: DealResult) -> None:
+        self.result = result
+        self.samples = 0
+        self.wins = 0
+        self.num_moves = 0
+        self.seconds = 0.0
+
+    def add(self, won: bool, num_moves: int, seconds: float) -> None:
+        self.samples += 1
+        self.wins += won
+        self.num_moves += num_moves
+        self.seconds += seconds
+
+    @property
+    def win_rate(self) -> float:
+        return self.wins / self.samples if self.samples else 0.0
+
+    def to_dict(self) -> dict:
+        "The estimate as a JSON-serializable dict."
+        low, high = wilson_interval(self.wins, self.samples)
+        return {
+            'foundation': len(self.result.foundation),
+            'samples': self.samples,
+            'wins': self.wins,
+            'win_rate': round(self.win_rate, 4),
+            'interval': [round(low, 4), round(high, 4)],
+            'nodes': self.num_moves,
+            'time': round(self.seconds, 6),
+        }
+
+    def __str__(self) -> str:
+        low, high = wilson_interval(self.wins, self.samples)
+        return (f"{len(self.result.foundation)} card(s) on the foundation: "
+                f"won {self.wins} of {self.samples} sampled redeal(s) "
+                f"({self.win_rate * 100:.1f}%; 95% confidence interval "
+                f"{low * 100:.1f}%-{high * 100:.1f}%), "
+                f"{self.num_moves} blocking move(s) searched in {self.seconds:.2f}s")
+
+
+class EndStateChooser:
+    """
+    Chooses how a deal other than the last should end, for
+    solve_game()'s /choose_ending/, by the chance of winning the game after
+    the redeal rather than by the number of cards on the foundation.
+
+    The /candidates/ end states with the most cards on the foundation (see
+    solve.deal_endings()) are each redealt /samples/ times, with shuffles
+    seeded from /seed/, and the rest of the game (up to /max_deal/, with
+    a merci on the final deal if /merci/ is set) is solved after each one;
+    /time_limit/, /max_nodes/ and /por/ are as for solve_deal(). The
+    samples are shared out among the processes of /pool/. If /time_budget/
+    is set, no more samples are started after that many seconds.
+
+    The candidate that won most often is chosen, or of equals, the one with
+    the most cards on the foundation. Its result's /redeal_estimates/ hold
+    a RedealEstimate for every candidate.
+
+    Finding the candidates is limited by /max_nodes/ and /time_budget/ as
+    well. If Ctrl-C is pressed while they're being found, /result/ is kept
+    as it is; if it's pressed while sampling, sampling stops and the choice
+    is made from the samples finished. Either way, the result is marked as
+    interrupted.
+    """
+    def __init__(self, pool: SearchPool, samples: int, candidates: int = 3,
+                 time_budget: Optional[float] = None, seed=None, max_deal: int = 3,
+                 merci: bool = False, time_limit: Optional[float] = None,
+                 max_nodes: Optional[int] = None, por: bool = True) -> None:
+        self.pool = pool
+        self.samples = samples
+        self.candidates = candidates
+        self.time_budget = time_budget
+        self.seed = seed if seed is not None else random.randrange(2**32)
+        self.max_deal = max_deal
+        self.merci = merci
+        self.search_options = {'time_limit': time_limit, 'max_nodes': max_nodes, 'por': por}
+
+    def __call__(self, result: DealResult) -> DealResult:
+        deadline = (time.monotonic() + self.time_budget
+                    if self.time_budget is not None else None)
+        pool = self.pool
+        pool.reset()
+        with StopOnInterrupt(pool.stop) as interrupt:
+            endings = deal_endings(result, self.candidates,
+                                   self.search_options['max_nodes'], deadline, pool.stop)
+        if len(endings) < 2 or interrupt.interrupted:
+            result.interrupted = result.interrupted or interrupt.interrupted
+            return result
+        estimates = [RedealEstimate(ending) for ending in endings]
+        options = dict(self.search_options, deal=result.deal + 1, max_deal=self.max_deal,
+                       merci=self.merci)
+        packed = [pack(ending.tableau, ending.foundation) for ending in endings]
+
+        def tasks():
+            # Sample by sample, so every candidate has about as many when time runs out.
+            for sample in range(self.samples):
+                for candidate in range(len(endings)):
+                    if pool.stop.value or (deadline is not None and time.monotonic() >= deadline):
+                        return
+                    yield candidate, sample, packed[candidate], self.seed, options
+
+        with StopOnInterrupt(pool.stop) as interrupt:
+            for candidate, won, num_moves, seconds, aborted in pool.imap_unordered(
+                    redeal_task, tasks(), window=pool.jobs * 4):
+                if not aborted:
+                    estimates[candidate].add(won, num_moves, seconds)
+
+        best = max(range(len(endings)),
+                   key=lambda idx: (estimates[idx].win_rate,
+                                    len(endings[idx].foundation), -idx))
+        chosen = endings[best]
+        chosen.redeal_estimates = estimates
+        chosen.interrupted = chosen.interrupted or interrupt.interrupted
+        return chosen
@@ -0,0 +1,161 @@
+import math
+import random
+import sys
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from .card import Deck, Shuffler
+from .instrument import Stopwatch
+from .lucie import Foundations, Tableau
+from .parallel import SearchPool, worker_state
+from .solve import solve_game
+
+# Ranges of cards left on the tableau (inclusive) to show in the histogram.
+CARDS_LEFT_BUCKETS = ((0, 0),) + tuple((low, min(low + 4, 52)) for low in range(1, 52, 5))
+
+
+def cards_left_histogram(counts: Counter) -> List[str]:
+    """
+    Draw a histogram of /counts/ (how many games had each number of cards
+    left on the tableau) in CARDS_LEFT_BUCKETS, one line per bucket.
+    """
+    total = sum(counts.values())
+    lines = []
+    for low, high in CARDS_LEFT_BUCKETS:
+        n = sum(c for left, c in counts.items() if low <= left <= high)
+        label = str(low) if low == high else f"{low}-{high}"
+        bar = '#' * round(n / total * 50)
+        lines.append(f"  {label:>5}: {n:6d} ({n / total * 100:5.1f}%) {bar}")
+    return lines
+
+
+def game_rng(seed, index: int) -> Shuffler:
+    """
+    Return the Shuffler for game number /index/ of a simulation seeded with
+    /seed/. It deals the game and shuffles any redeals, so each game is the
+    same no matter which worker (or machine) plays it or what that worker
+    played before.
+    """
+    return Shuffler(seed, index)
+
+
+def deal_game(rng: Shuffler) -> Tableau:
+    """
+    Deal a game with the next shuffle of /rng/ (e.g., game_rng(seed, index)
+    for game number /index/ of a simulation seeded with /seed/).
+    """
+    deck = Deck()
+    deck.fill()
+    deck.shuffle(rng)
+    tableau = Tableau()
+    tableau.deal(deck)
+    return tableau
+
+
+def simulate_task(task: Tuple[int, object, dict]) -> Tuple[int, bool, List[int], int, bool]:
+    """
+    Deal and solve one game of a simulation in a SearchPool worker. Return
+    the game's index, whether it was won, the number of cards left on the
+    tableau after each deal, the number of blocking moves searched, and
+    whether every deal was searched to the end (see DealResult.optimal).
+    """
+    index, seed, options = task
+    rng = game_rng(seed, index)
+    tableau = deal_game(rng)
+    result = solve_game(tableau, Foundations(), options['deal'], options['max_deal'],
+                        options['redeal'], options['merci'], rng,
+                        table=worker_state().table, time_limit=options['time_limit'],
+                        max_nodes=options['max_nodes'], por=options['por'])
+    return (index, result.solved, [len(deal.tableau) for deal in result.deals],
+            sum(deal.num_moves for deal in result.deals), result.optimal)
+
+
+def wilson_interval(successes: int, trials: int, z: float = 1.96) -> Tuple[float, float]:
+    """
+    Return the Wilson score interval for a proportion of /successes/ out of
+    /trials/: by default, a 95% confidence interval. Unlike the usual
+    normal approximation, it behaves sensibly for win rates near 0 or 1.
+    """
+    if not trials:
+        return 0.0, 1.0
+    p = successes / trials
+    denominator = 1 + z**2 / trials
+    centre = (p + z**2 / (2 * trials)) / denominator
+    spread = z * math.sqrt(p * (1 - p) / trials + z**2 / (4 * trials**2)) / denominator
+    return max(0.0, centre - spread), min(1.0, centre + spread)
+
+
+class Simulation:
+    "Tallies the results of the games of a simulation as they come in."
+    def __init__(self) -> None:
+        self.games = 0
+        self.wins = 0
+        self.num_moves = 0
+        self.cut_short = 0
+        #: For each deal, how many games had each number of cards left after it.
+        self.cards_left: Dict[int, Counter] = {}
+
+    def add(self, won: bool, cards_left: List[int], num_moves: int, optimal: bool) -> None:
+        self.games += 1
+        self.wins += won
+        self.num_moves += num_moves
+        self.cut_short += not optimal
+        for deal_idx, left in enumerate(cards_left):
+            self.cards_left.setdefault(deal_idx, Counter())[left] += 1
+
+    @property
+    def win_rate(self) -> float:
+        return self.wins / self.games if self.games else 0.0
+
+    def report(self, first_deal: int, elapsed: float) -> str:
+        low, high = wilson_interval(self.wins, self.games)
+        lines = [
+            f"Played {self.games} game(s) in {elapsed:.2f}s "
+            f"({self.games / elapsed if elapsed else 0.0:.2f} games/sec, "
+            f"{self.num_moves} blocking move(s) searched).",
+            f"Won {self.wins} ({self.win_rate * 100:.2f}%; "
+            f"95% confidence interval {low * 100:.2f}%-{high * 100:.2f}%).",
+        ]
+        if self.cut_short:
+            lines.append(f"The search limits cut short {self.cut_short} game(s), "
+                         f"so the true win rate may be higher.")
+        for deal_idx, counts in sorted(self.cards_left.items()):
+            played = sum(counts.values())
+            mean = sum(left * n for left, n in counts.items()) / played
+            lines.append("")
+            lines.append(f"Cards left on the tableau after deal {first_deal + deal_idx} "
+                         f"({played} game(s), mean {mean:.1f}):")
+            lines.extend(cards_left_histogram(counts))
+        return '\n'.join(lines)
+
+
+def run_simulation(args) -> int:
+    """
+    Deal and solve args.games random games, starting from game number
+    args.first, under the rules in /args/, across the processes of a
+    SearchPool, and print statistics about how they went. Return the exit
+    status.
+    """
+    seed = args.seed if args.seed is not None else random.randrange(2**32)
+    options = {'deal': args.deal, 'max_deal': args.max_deal, 'redeal': args.redeal,
+               'merci': args.merci, 'time_limit': args.time_limit,
+               'max_nodes': args.max_nodes, 'por': args.por}
+    print(f"Simulating {args.games} game(s) with seed {seed}"
+          + (f", starting from game {args.first}" if args.first else "") + "...")
+
+    watch = Stopwatch()
+    sim = Simulation()
+    tasks = ((index, seed, options) for index in range(args.first, args.first + args.games))
+    with SearchPool(args.jobs, args.table_size, args.table_policy) as pool:
+        for _, won, cards_left, num_moves, optimal in pool.imap_unordered(
+                simulate_task, tasks, window=pool.jobs * 4):
+            sim.add(won, cards_left, num_moves, optimal)
+            if sys.stderr.isatty():
+                sys.stderr.write(f"\r  {sim.games}/{args.games} game(s), "
+                                 f"{sim.wins} won   ")
+    if sys.stderr.isatty():
+        sys.stderr.write("\n")
+
+    watch.checkpoint()
+    print(sim.report(args.deal, watch.running_time))
+    return 0
@@ -1,211 +1,1398 @@
-from copy import deepcopy
-from multiprocessing import Process, Queue, Value
-from operator import itemgetter
-from typing import List
+import heapq
+import os
+import random
+import time
+from multiprocessing import Value
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
 
-from .lucie import Tableau, Foundations, Move
+from .card import Deck, Shuffler
+from .instrument import SearchStats, Stopwatch, peak_rss
+from .lucie import ChangeLog, Fan, Tableau, Foundations, Move
+from .parallel import StopOnInterrupt, worker_state
+from .state import pack, unpack
+from .transposition import Entry, TranspositionTable, position_key
 
 
-def move_players(tableau: Tableau, found: Foundations, move_stack: List) -> bool:
+def move_players(tableau: Tableau, found: Foundations, move_stack: List,
+                 log: Optional[ChangeLog] = None) -> bool:
     """
     Scan all fans and move all possible cards to the foundations. Repeat
     until a complete scan of all fans has been made and no plays were
     possible.
+
+    Rather than checking every fan, each scan starts from the fans holding
+    the cards the foundation piles need next (found with the tableau's
+    index), and a fan further along is added whenever a foundation move
+    uncovers the card it needs; anything before it waits for the next scan.
+    The moves are made in the same order as checking every fan would.
     """
+    if log is None:
+        log = ChangeLog()
+    fan_of = tableau.index.fan_of
     function_success = False
-    any_success = True  # to pass the loop the first time
-    while any_success:
-        any_success = False
-        for fan in tableau.fans:
-            while fan and found.insert(fan.top()):
-                move_stack.append(Move(fan.top()))
-                function_success = any_success = True
-                fan.pop()
-        tableau.teardown_empty_fans()
-    return function_success
+    while True:
+        ready = []
+        for card in found.next_cards():
+            fan = fan_of[card.id]
+            if fan is not None and fan.cards[-1] is card:
+                ready.append(fan)
+        if not ready:
+            return function_success
+
+        # One scan over the fans, in order.
+        positions = {id(fan): idx for idx, fan in enumerate(tableau.fans)}
+        queue = [positions[id(fan)] for fan in ready]
+        queued = set(queue)
+        heapq.heapify(queue)
+        while queue:
+            position = heapq.heappop(queue)
+            fan = tableau.fans[position]
+            while fan and found.can_insert(fan.top()):
+                card = fan.top()
+                move_stack.append(Move(card))
+                function_success = True
+                log.insert(found, log.pop(fan))
+                following = card.after()
+                if following is not None:
+                    next_fan = fan_of[following.id]
+                    if next_fan is not None and next_fan.cards[-1] is following:
+                        next_position = positions[id(next_fan)]
+                        if next_position > position and next_position not in queued:
+                            queued.add(next_position)
+                            heapq.heappush(queue, next_position)
+        log.teardown(tableau)
+
+
+def _safe_build_targets(tableau: Tableau, fans: Iterable[Fan]) -> Dict[int, Fan]:
+    """
+    Return the fans among /fans/ that some top card can be safely built
+    onto, keyed by id.
+    """
+    fan_of = tableau.index.fan_of
+    targets = {}
+    for fan in fans:
+        if not fan:
+            continue
+        wanted = fan.cards[-1].before()
+        if wanted is None:
+            continue
+        source = fan_of[wanted.id]
+        if source is not None and source.cards[-1] is wanted and fan.safe_build(wanted):
+            targets[id(fan)] = fan
+    return targets
 
 
-def safe_builds(tableau, move_stack: List) -> bool:
+def _affected_fans(tableau: Tableau, changed: Iterable[Fan]) -> List[Fan]:
+    """
+    Return the fans whose safe builds might have changed when the cards of
+    the fans in /changed/ did: those fans, and the fans their new top cards
+    can be built onto.
+    """
+    wanted_by = tableau.index.wanted_by
+    fans = []
+    for fan in changed:
+        if fan:
+            fans.append(fan)
+            target = wanted_by[fan.cards[-1].id]
+            if target is not None:
+                fans.append(target)
+    return fans
+
+
+def safe_builds(tableau, move_stack: List, log: Optional[ChangeLog] = None,
+                candidates: Optional[Iterable[Fan]] = None) -> bool:
     """
     Scan all fans and perform all safe builds. Repeat until a complete
     scan of all fans has been made and no plays were possible.
 
+    Each time, the safe build made is the one onto the leftmost fan that
+    has one. If /candidates/ is given, only those fans are checked at first,
+    which is enough if no other fan could have a safe build (e.g., when they
+    are the fans affected by the moves since the last time there were none).
+    After each build, only the fans it could affect are checked again.
+
     TODO: Probably we should do foundation moves after *each* safe build?
     e.g., this is a little silly: [Safe build     ] A♣ => 7♠  5♦  3♣  2♣
     """
+    if log is None:
+        log = ChangeLog()
+    fan_of = tableau.index.fan_of
+    targets = _safe_build_targets(tableau, tableau.fans if candidates is None else candidates)
     function_success = False
-    any_success = True  # to pass the loop the first time
-    while any_success:
-        any_success = False
-        break_out = False
-        for t_idx, target_fan in enumerate(tableau.fans):
-            for source_fan in tableau.fans:
-                if target_fan.safe_build(source_fan.top()):
-                    move_stack.append(Move(source_fan.top(), target_fan, t_idx, is_safe=True))
-                    target_fan.push(source_fan.pop())
-                    function_success = any_success = True
-                    break_out = True
-                    break  # must tear down empty fans now
-            if break_out:
-                break
-        tableau.teardown_empty_fans()
+    while targets:
+        positions = {id(fan): idx for idx, fan in enumerate(tableau.fans)}
+        t_idx = min(positions[key] for key in targets)
+        target_fan = tableau.fans[t_idx]
+        card = target_fan.cards[-1].before()
+        source_fan = fan_of[card.id]
+        move_stack.append(Move(card, t_idx, is_safe=True))
+        log.push(target_fan, log.pop(source_fan))
+        if not source_fan:
+            log.teardown(tableau)
+        function_success = True
+        targets = _safe_build_targets(
+            tableau, [*targets.values(), *_affected_fans(tableau, (target_fan, source_fan))])
     return function_success
 
 
-def run_automatic_actions(tableau, foundation, move_stack) -> None:
+def run_automatic_actions(tableau, foundation, move_stack,
+                          log: Optional[ChangeLog] = None,
+                          changed: Optional[Iterable[Fan]] = None) -> None:
+    """
+    Perform all actions that are always safe. If a ChangeLog is provided,
+    they are recorded there so they can be undone.
+
+    If the position had no automatic moves left to make before the fans in
+    /changed/ were changed (e.g., by a blocking move), only the fans that
+    could be affected are checked for safe builds.
     """
-    Perform all actions that are always safe.
+    if log is None:
+        log = ChangeLog()
+    if changed is None:
+        log.teardown(tableau)
+        candidates = None
+    else:
+        changed = list(changed)
+        if not all(changed):
+            log.teardown(tableau)
+        candidates = _affected_fans(tableau, changed)
+    while True:
+        mark = log.mark()
+        if move_players(tableau, foundation, move_stack, log) and candidates is not None:
+            candidates.extend(_affected_fans(tableau, log.changes_since(mark)[0]))
+        if not safe_builds(tableau, move_stack, log, candidates):
+            return
+        candidates = []
+
+
+def dead_ranks(fans: Iterable[Fan], lowest_dead: Optional[List[int]] = None) -> List[int]:
     """
-    while move_players(tableau, foundation, move_stack) or safe_builds(tableau, move_stack):
-        pass
+    Return, by suit, the lowest rank (0 for an ace; 13 if none) that the
+    cards of /fans/ show can never reach the foundation this deal, without
+    a merci, starting from what's already known in /lowest_dead/ (which is
+    updated in place, if provided).
 
+    A card can never reach the foundation if it lies beneath a higher card
+    of its suit that can never leave the fan: a king, or a card whose
+    successor lies beneath it in the same fan. (The higher card could only
+    leave by going to the foundation, which needs the lower card to go
+    first.) Nor can any higher card of the buried card's suit.
+    """
+    if lowest_dead is None:
+        lowest_dead = [13] * 4
+    # Cards of a suit have consecutive ids, so comparing ids compares suits
+    # and ranks at once.
+    for fan in fans:
+        cards = fan.cards
+        for y_idx in range(1, len(cards)):
+            blocker = cards[y_idx]
+            successor = blocker.after()
+            below = cards[:y_idx]
+            if successor is not None and successor not in below:
+                continue
+            suit_idx, rank = divmod(blocker.id, 13)
+            first_id = blocker.id - rank
+            for card in below:
+                if first_id <= card.id < blocker.id and card.id - first_id < lowest_dead[suit_idx]:
+                    lowest_dead[suit_idx] = card.id - first_id
+    return lowest_dead
 
-def maximize_state(cur_best_foundation, new_foundation, cur_best_state, new_state):
-    if new_foundation > cur_best_foundation:
-        return new_foundation, new_state
-    else:
-        return cur_best_foundation, cur_best_state
 
+def deadlock_analysis(tableau: Tableau, lowest_dead: Optional[List[int]] = None) -> List[int]:
+    """
+    Return, by suit, the lowest rank (0 for an ace; 13 if none) that can
+    never reach the foundation this deal, without a merci.
+
+    This starts from dead_ranks() and adds the cards that can never move
+    at all, which can't reach the foundation either, nor can anything
+    beneath them in their fans: a card is frozen if it can't reach the
+    foundation and can't be built onto its successor either, because it's
+    a king, its successor lies beneath it, or its successor lies beneath a
+    frozen card. Each card found dead can freeze more, so this is repeated
+    until nothing changes.
 
-def try_legal_move(tableau, foundation, move_stack, merci, move, reclvl, best_foundation, best_state, num_moves, q = None):
+    Nothing found here can come back to life while the deal goes on (only
+    a merci could rescue it), so the search works this out once at the
+    start and updates it with dead_ranks() as moves are made. If the
+    dead_ranks() of the tableau are already known, pass them as
+    /lowest_dead/ (which is updated in place).
     """
-    Attempt to make one blocking move and following series of automatic moves.
-    Mutually recursive with recursive_hypothetical().
+    if lowest_dead is None:
+        lowest_dead = dead_ranks(tableau.fans)
+    if lowest_dead == [13] * 4:
+        # Only dead cards can be frozen.
+        return lowest_dead
+    fans = [fan.cards for fan in tableau.fans]
+    where = {card.id: (fan_idx, card_idx)
+             for fan_idx, cards in enumerate(fans) for card_idx, card in enumerate(cards)}
+    # The position of the highest frozen card in each fan (-1 if none); the
+    # cards beneath it can never be uncovered.
+    frozen = [-1] * len(fans)
+    changed = True
+    while changed:
+        changed = False
+        for fan_idx, cards in enumerate(fans):
+            for card_idx in range(len(cards) - 1, frozen[fan_idx], -1):
+                card = cards[card_idx]
+                suit_idx, rank = divmod(card.id, 13)
+                if rank < lowest_dead[suit_idx]:
+                    continue
+                successor = card.after()
+                if successor is not None:
+                    # Higher than a dead card, so dead and on the tableau.
+                    succ_fan, succ_idx = where[successor.id]
+                    if not ((succ_fan == fan_idx and succ_idx < card_idx)
+                            or succ_idx < frozen[succ_fan]):
+                        continue
+                frozen[fan_idx] = card_idx
+                changed = True
+                for buried in cards[:card_idx]:
+                    suit_idx, rank = divmod(buried.id, 13)
+                    if rank < lowest_dead[suit_idx]:
+                        lowest_dead[suit_idx] = rank
+                break
+    return lowest_dead
+
+
+def foundation_bound(tableau: Tableau, foundation: Foundations, merci: bool = False,
+                     lowest_dead: Optional[List[int]] = None) -> int:
+    """
+    Return an upper bound on the number of cards that can be on the
+    foundation at the end of this deal: every card, less those that
+    deadlock_analysis() (or /lowest_dead/, if already known) shows can
+    never get there.
+
+    A merci can rescue any one card, so if one is available, the bound is
+    simply every card in the game.
     """
-    if num_moves.value == 0 or not num_moves.value % 100:
-        print(f"\r  Searched {num_moves.value} legal permutations...", end='')
-    num_moves.value += 1
+    total = len(foundation) + len(tableau)
+    if merci:
+        return total
+    if lowest_dead is None:
+        lowest_dead = deadlock_analysis(tableau)
+    return total - sum(13 - rank for rank in lowest_dead)
+
+
+class SearchContext:
+    """
+    State shared by every node of one search.
+
+    /incumbent/ holds the largest foundation count of any line found so
+    far, shared with any worker processes; a subtree whose foundation_bound()
+    can't beat it is not searched. Once it reaches /target/ (an upper bound
+    for the whole search), nothing better is possible, and the search stops.
+
+    The search also stops, settling for the best line found so far, when
+    /stop/ (a flag shared with any worker processes) is set, e.g., on
+    Ctrl-C; when time.monotonic() passes /deadline/; or when /max_nodes/
+    legal permutations have been searched. Either of the latter sets /stop/,
+    so every process stops together. It also stops when /abort/ is set: a
+    flag this search only reads, never sets, such as the stop flag of a
+    SearchPool whose task the search is running in.
+
+    /por/ turns on partial-order reduction (see search_position()).
+
+    If /stats/ is provided, the search's SearchStats are added to it.
+    """
+    def __init__(self, num_moves, table: Optional[TranspositionTable] = None,
+                 target: int = 52, incumbent=None, verbose: bool = True,
+                 stop=None, deadline: Optional[float] = None,
+                 max_nodes: Optional[int] = None, por: bool = True,
+                 stats: Optional[SearchStats] = None, abort=None) -> None:
+        self.num_moves = num_moves
+        self.verbose = verbose
+        self.table = table
+        self.target = target
+        self.incumbent = incumbent if incumbent is not None else Value('i', -1)
+        self.stop = stop if stop is not None else Value('b', 0)
+        self.abort = abort
+        self.deadline = deadline
+        self.max_nodes = max_nodes
+        self.por = por
+        self.stats = stats
+        self.log = ChangeLog()
+
+    def improve(self, count: int) -> None:
+        "Record that a line reaching /count/ foundation cards exists."
+        if count > self.incumbent.value:
+            with self.incumbent.get_lock():
+                if count > self.incumbent.value:
+                    self.incumbent.value = count
+
+    @property
+    def finished(self) -> bool:
+        return self.incumbent.value >= self.target
+
+    @property
+    def halted(self) -> bool:
+        "Whether the search has been told to stop, without checking its budget."
+        return bool(self.stop.value) or (self.abort is not None and bool(self.abort.value))
+
+    @property
+    def stopped(self) -> bool:
+        "Whether the search has run out of budget or been interrupted."
+        if self.halted:
+            return True
+        if ((self.deadline is not None and time.monotonic() >= self.deadline)
+                or (self.max_nodes is not None and self.num_moves.value >= self.max_nodes)):
+            self.stop.value = 1
+            return True
+        return False
+
 
+# The search's result for a subtree: the number of cards on the foundation at
+# the end of the best line found (-1 if none); that line's principal
+# variation, or None if the subtree was cut off; and an upper bound on what
+# any line in the subtree could reach. The count is exact -- the line is the
+# best in the subtree -- when the bound is no larger.
+#
+# A principal variation is just the blocking moves (and merci) of the line,
+# as a bytes object holding the move_key() of each; the automatic moves and
+# the final position follow from them, and are worked out by replay_line()
+# once the search is over, so the search never copies a position or a move
+# stack.
+Result = Tuple[int, Optional[bytes], int]
+
+MERCI_FLAG = 0x40
+FOUNDATION_FLAG = 0x80
+
+
+def make_move(tableau, foundation, move_stack, move, log: ChangeLog,
+              stats: Optional[SearchStats] = None) -> None:
+    """
+    Make a blocking move (or merci) and the series of automatic moves that
+    follows it, recording all the changes in /log/ (and the automatic moves
+    in /stats/, if provided).
+    """
     cur_fan = tableau.fan_of(move.card)
     assert cur_fan is not None
+    mark = log.mark()
+    log.pop(cur_fan, move.card)
+    move_stack.append(move)
+    move.apply(tableau, foundation, log)
+    if stats is None:
+        run_automatic_actions(tableau, foundation, move_stack, log, log.changes_since(mark)[0])
+        return
+    start, stack_size = time.perf_counter(), len(move_stack)
+    run_automatic_actions(tableau, foundation, move_stack, log, log.changes_since(mark)[0])
+    stats.automatic_moves += len(move_stack) - stack_size
+    stats.add_time('automatic', start)
+
+
+def order_moves(tableau: Tableau, foundation: Foundations, legal_moves: List[Move]) -> List[Move]:
+    """
+    Sort /legal_moves/ so the most promising are tried first: moves that
+    play a card to the foundation or uncover one that can go there, then
+    moves that uncover a card that can itself be built on another fan.
+    Good lines found early make the branch-and-bound cut off more, and leave
+    a better line in hand if the search is stopped early.
+    """
+    tops = {fan.top(): fan for fan in tableau.fans}
+
+    def priority(move: Move) -> int:
+        if move.is_merci:
+            return 0 if move.is_foundation_move else 2
+        fan = tops[move.card]
+        if len(fan) < 2:
+            return 2
+        uncovered = fan[-2]
+        if foundation.can_insert(uncovered):
+            return 0
+        return 1 if uncovered.after() in tops else 2
+
+    return sorted(legal_moves, key=priority)
+
+
+def count_move(ctx: SearchContext, reclvl: int) -> None:
+    """
+    Count one more legal permutation searched, at depth /reclvl/, and report
+    progress now and then.
+
+    The count may be shared with worker processes, so it's only changed
+    under its lock, or some increments could be lost.
+    """
+    num_moves = ctx.num_moves
+    with num_moves.get_lock():
+        searched = num_moves.value
+        num_moves.value = searched + 1
+    if ctx.verbose and (searched == 0 or not searched % 100):
+        print(f"\r  Searched {searched} legal permutations...", end='')
+    if ctx.stats is not None:
+        ctx.stats.count_node(reclvl)
+
+
+# What a move and the automatic moves following it touched: the fans changed
+# (by identity), a bitmask of the suits of the cards moved and of the cards
+# left on top of those fans, and whether the move was a merci.
+Footprint = Tuple[frozenset, int, bool]
+
+
+def move_key(move: Move) -> int:
+    """
+    Identify a blocking move or merci independently of the position, in a
+    byte: a card can only ever be moved onto its successor (or the
+    foundation), so the card's id and whether the move is a merci and goes
+    to the foundation are enough.
+    """
+    return (move.card.id | (MERCI_FLAG if move.is_merci else 0)
+            | (FOUNDATION_FLAG if move.is_foundation_move else 0))
+
+
+def footprint(log: ChangeLog, mark: int, move: Move) -> Footprint:
+    "Return the Footprint of /move/, which has just been made, recorded in /log/ after /mark/."
+    fans, cards = log.changes_since(mark)
+    suits = 0
+    for card in cards:
+        suits |= 1 << card.id // 13
+    for fan in fans:
+        if fan:
+            suits |= 1 << fan.top().id // 13
+    return frozenset(id(fan) for fan in fans), suits, move.is_merci
+
+
+def independent(a: Footprint, b: Footprint) -> bool:
+    """
+    Whether two moves from the same position commute: making either one
+    leaves the other legal, and making both in either order (with the
+    automatic moves after each) reaches the same position. That's so if
+    they touch different fans and different suits, except that only one
+    merci is allowed.
+    """
+    return not a[1] & b[1] and not (a[2] and b[2]) and a[0].isdisjoint(b[0])
+
+
+def try_legal_move(tableau, foundation, move_stack, merci, move, reclvl,
+                   ctx: SearchContext, sleep: Optional[dict] = None,
+                   dead: Optional[List[int]] = None) -> Result:
+    """
+    Attempt to make one blocking move and following series of automatic moves.
+    Mutually recursive with search_position().
+
+    The move is made in place and undone (via the context's ChangeLog)
+    before returning, leaving the tableau, foundation and move stack as they
+    were.
+
+    /sleep/ is the sleep set of the position the move is made from (see
+    search_position()); the move is added to it once its subtree has been
+    searched. /dead/ is what deadlock_analysis() found for that position.
+    """
+    count_move(ctx, reclvl)
+    log = ctx.log
+    mark = log.mark()
+    stack_mark = len(move_stack)
 
     # Move cards as appropriate, and unset merci for future moves if we did a merci.
-    cur_fan.pop(move.card)
-    move_stack.append(move)
-    move.apply(tableau, foundation)
+    make_move(tableau, foundation, move_stack, move, log, ctx.stats)
     merci = merci and not move.is_merci
 
-    # Proceed as far as we can with automatic actions.
-    run_automatic_actions(tableau, foundation, move_stack)
+    # Moves already searched from the parent that commute with this one lead
+    # to positions that have been (or will be) reached the other way round.
+    child_sleep = None
+    if sleep is not None:
+        move_footprint = footprint(log, mark, move)
+        child_sleep = {key: fp for key, fp in sleep.items()
+                       if independent(fp, move_footprint)}
+
+    # Whatever was dead still is, so only the fans just changed can add to
+    # it -- unless a merci rescued something.
+    child_dead = None
+    if dead is not None and not move.is_merci:
+        child_dead = dead_ranks(log.changes_since(mark)[0], list(dead))
 
     # Recurse into child states, recording the best state of any child.
     #print(" " * 2 * reclvl + f"Foundation size after this move: {len(foundation)}")
-    child_foundation, child_state = recursive_hypothetical(tableau, foundation, move_stack, merci, num_moves, reclvl+1)
-    best_state = maximize_state(best_foundation, child_foundation, best_state, child_state)
+    result = search_position(tableau, foundation, move_stack, merci, reclvl+1, ctx,
+                             child_sleep, child_dead)
 
-    if q is not None:
-        q.put(best_state)
-    else:
-        return best_state
+    log.undo(mark)
+    del move_stack[stack_mark:]
+    if sleep is not None:
+        sleep[move_key(move)] = move_footprint
+    return result
 
 
-def recursive_hypothetical(tableau, foundation, move_stack, merci=False, num_moves=None, reclvl=0):
+def recall_move(tableau, foundation, move_stack, merci, move,
+                ctx: SearchContext) -> Optional[Result]:
     """
-    Perform a complete tree search for the best possible series of blocking
-    moves. Between each blocking move, all automatic moves are applied. The
-    "best" series of blocking moves is the one that ends (reaches a state
-    with no more legal moves) with the largest number of cards on the
-    foundation. (Nothing else matters because we reshuffle the tableau once
-    we reach that end state anyway.)
+    Return the result of making /move/ if the position it leads to is in the
+    transposition table, without searching it, or None if it isn't.
     """
-    if merci:
+    if ctx.table is None:
+        return None
+    log = ctx.log
+    mark = log.mark()
+    stack_mark = len(move_stack)
+    make_move(tableau, foundation, move_stack, move, log, ctx.stats)
+    entry = ctx.table.lookup(position_key(tableau, foundation, merci and not move.is_merci))
+    result = None
+    if entry is not None:
+        result = entry.foundation_count, entry.line, entry.foundation_count
+    log.undo(mark)
+    del move_stack[stack_mark:]
+    return result
+
+
+def search_position(tableau, foundation, move_stack, merci, reclvl,
+                    ctx: SearchContext, sleep: Optional[dict] = None,
+                    dead: Optional[List[int]] = None) -> Result:
+    """
+    Search the subtree beneath the current position, as described in
+    recursive_hypothetical(). Only the best line's foundation count and
+    principal variation are kept, so each level of the search holds a
+    constant amount of state beyond the position itself.
+
+    If the context's /por/ is set, the search uses partial-order reduction:
+    /sleep/ is the position's sleep set, mapping the move_key() of each
+    move that needn't be tried here to its Footprint. These are moves that
+    commute with the move that led here and were already tried from the
+    parent, so every line starting with one of them is searched elsewhere in
+    the other order. The moves tried here are added to the set as they're
+    searched, and each child's sleep set is the part of it that commutes with
+    the move leading to that child. Each set of commuting moves is thus
+    searched in only one order.
+
+    /dead/ is the deadlock_analysis() of the position, if known from its
+    parent; the search stops trying moves once a line reaches the
+    foundation_bound() it gives.
+    """
+    # Don't bother if nothing here can beat the best line found so far.
+    if dead is None and not merci:
+        # The quick part of the analysis is often enough to tell.
+        dead = dead_ranks(tableau.fans)
+        if foundation_bound(tableau, foundation, merci, dead) > ctx.incumbent.value:
+            deadlock_analysis(tableau, dead)
+    bound = foundation_bound(tableau, foundation, merci, dead)
+    if bound <= ctx.incumbent.value:
+        return -1, None, bound
+
+    stats = ctx.stats
+    if stats is None:
         legal_moves = tableau.moves(merci, foundation)
     else:
-        legal_moves = tableau.moves()
+        start = time.perf_counter()
+        legal_moves = tableau.moves(merci, foundation)
+        stats.add_time('movegen', start)
+        if legal_moves:
+            stats.positions += 1
+            stats.children += len(legal_moves)
+        else:
+            stats.leaves += 1
 
     # Base case: There are no legal moves in this state. This can happen either
     # because we are blocked or because we have won. Return the number of
     # cards on the foundation.
     if not legal_moves:
         #print(" " * 2 * reclvl + f"No legal moves at level {reclvl}.")
-        return len(foundation), (tableau, foundation, move_stack)
+        count = len(foundation)
+        ctx.improve(count)
+        return count, b'', count
+
+    # If we've been here before, reuse what we found then.
+    table = ctx.table
+    if table is not None:
+        key = position_key(tableau, foundation, merci)
+        entry = table.lookup(key)
+        if entry is not None:
+            count = entry.foundation_count
+            ctx.improve(count)
+            return count, entry.line, count
+
+    # Lines skipped because of the sleep set are searched elsewhere; if any
+    # are skipped, the result is only the best of the rest and can't go in
+    # the table.
+    complete = True
+    if sleep is None and ctx.por:
+        sleep = {}
 
     # Recursive case: find the sequence of moves following on from this one.
-    best_foundation = 0
-    best_state = None
-    states = []
-    processes = []
-    q = Queue()
+    # The first of several equally good lines wins.
+    best_count, best_line = -1, None
+    cutoff_bound = -1  # the best any child could have done
+    for move in order_moves(tableau, foundation, legal_moves):
+        if best_count >= bound:
+            # Nothing else from here can do better.
+            break
+        if ctx.finished or ctx.stopped:
+            cutoff_bound = bound
+            break
+        if sleep and move_key(move) in sleep:
+            # If the position this leads to is already in the table, using
+            # it is cheap and keeps this result complete.
+            result = recall_move(tableau, foundation, move_stack, merci, move, ctx)
+            if result is None:
+                complete = False
+                continue
+            count, line, child_bound = result
+        else:
+            count, line, child_bound = try_legal_move(tableau, foundation, move_stack,
+                                                      merci, move, reclvl, ctx, sleep, dead)
+        if line is not None and count > best_count:
+            best_count, best_line = count, bytes((move_key(move),)) + line
+        cutoff_bound = max(cutoff_bound, child_bound)
+
+    if best_line is None:
+        if ctx.halted:
+            # Stopped before finding any line from here, so settle for
+            # stopping here.
+            return len(foundation), b'', bound
+        # Everything was cut off.
+        return -1, None, cutoff_bound
+
+    # The result is exact unless some child that might have done better was
+    # cut off; only exact results can be reused by the transposition table.
+    if table is not None and complete and cutoff_bound <= best_count:
+        table.store(key, Entry(best_count, best_line))
+    return best_count, best_line, max(best_count, cutoff_bound)
+
+
+def split_tree(tableau, foundation, move_stack, merci, depth, ctx: SearchContext,
+               tasks: dict, reclvl: int = 0, line: bytes = b'') -> None:
+    """
+    Expand the search tree down to /depth/ blocking moves, adding each
+    position at that depth (or where there are no more legal moves) to
+    /tasks/, a dict mapping a position key to a task for _search_task().
+    A position reached by more than one order of moves only becomes one task.
+    /line/ is the principal variation of the moves made to get here.
+    """
+    legal_moves = tableau.moves(merci, foundation) if depth > 0 else None
+    if not legal_moves:
+        key = position_key(tableau, foundation, merci)
+        if key not in tasks:
+            tasks[key] = (len(tasks), pack(tableau, foundation), line,
+                          merci, ctx.target, ctx.verbose, ctx.deadline, ctx.max_nodes, ctx.por,
+                          reclvl, ctx.stats is not None)
+        return
 
+    if ctx.stats is not None:
+        ctx.stats.positions += 1
+        ctx.stats.children += len(legal_moves)
+    log = ctx.log
     for move in legal_moves:
-        # Take a copy of the tableau and foundation.
-        t = deepcopy(tableau)
-        f = deepcopy(foundation)
-        ms = deepcopy(move_stack)
-
-        my_args = [t, f, ms, merci, move, reclvl, best_foundation, best_state, num_moves]
-        if reclvl == 0:
-            my_args.append(q)
-            p = Process(target=try_legal_move, args=my_args)
-            processes.append(p)
-        else:
-            states.append(try_legal_move(*my_args))
-
-    if reclvl == 0:
-        print(f"DFS for best blocking moves using {len(processes)} thread(s):")
-        for p in processes:
-            p.start()
-        for p in processes:
-            states.append(q.get())
-
-    # Select the best state of any child move.
-    return sorted(states, key=itemgetter(0))[-1]
-
-
-def play_deal(tableau, found, deal, merci=False):
-    print("")
-    print(f"========== Deal {deal} ==========")
-    print("Starting tableau:")
-    print(tableau)
-    print("")
-    orig_tableau_length = len(tableau)
-    if found:
-        print("Starting foundation:")
-        print(found)
-        print("")
+        with ctx.num_moves.get_lock():
+            ctx.num_moves.value += 1
+        if ctx.stats is not None:
+            ctx.stats.count_node(reclvl)
+        mark = log.mark()
+        stack_mark = len(move_stack)
+        make_move(tableau, foundation, move_stack, move, log, ctx.stats)
+        split_tree(tableau, foundation, move_stack, merci and not move.is_merci,
+                   depth - 1, ctx, tasks, reclvl + 1, line + bytes((move_key(move),)))
+        log.undo(mark)
+        del move_stack[stack_mark:]
 
-    move_stack = []
-    run_automatic_actions(tableau, found, move_stack)
 
-    if len(found) == 52:
-        print("The deal was solved by automatic moves.")
+def _search_task(task) -> tuple:
+    """
+    Search one subtree split off by split_tree() in a SearchPool worker.
+    Return the task's index, the search result, the worker's transposition
+    table counters for this task, and the task's SearchStats (if the task
+    asked for them; otherwise None).
+
+    Only the principal variation of the best line within the subtree is
+    sent back; the caller already has the moves that lead to the subtree,
+    and works out the final position itself.
+    """
+    (index, packed, _, merci, target, verbose, deadline, max_nodes, por,
+     reclvl, want_stats) = task
+    worker = worker_state()
+    table = worker.table
+    before = table.counters() if table is not None else (0, 0, 0)
+    stats = SearchStats() if want_stats else None
+    start = time.perf_counter()
+
+    tableau, foundation = unpack(packed)
+    ctx = SearchContext(worker.num_moves, table, target, worker.incumbent, verbose,
+                        worker.stop, deadline, max_nodes, por, stats)
+    result = search_position(tableau, foundation, [], merci, reclvl, ctx)
+
+    if stats is not None:
+        stats.add_worker(f"pid {os.getpid()}", stats.nodes, time.perf_counter() - start, peak_rss())
+    after = table.counters() if table is not None else (0, 0, 0)
+    return index, result, tuple(a - b for a, b in zip(after, before)), stats
+
+
+class MerciCandidate(NamedTuple):
+    """
+    A merci to be searched after by search_mercis(): the number of cards on
+    the foundation once it and its automatic moves are made, the number of
+    blocking moves (and the merci) made to get there, the position the merci
+    is made from, packed by state.pack(), the principal variation of the
+    moves up to and including the merci, and the merci itself.
+    """
+    foundation_count: int
+    depth: int
+    packed: bytes
+    line: bytes
+    merci: Move
+
+    def position(self) -> Tuple[Tableau, Foundations]:
+        "Return a new tableau and foundation for the position after the merci."
+        tableau, foundation = unpack(self.packed)
+        # Unpacking keeps the order of the fans, so the merci still applies.
+        make_move(tableau, foundation, [], self.merci, ChangeLog())
+        return tableau, foundation
+
+
+def collect_mercis(tableau, foundation, move_stack, reclvl, ctx: SearchContext,
+                   visited: set, candidates: dict, line: bytes = b'',
+                   sleep: Optional[dict] = None) -> Tuple[int, bytes]:
+    """
+    Visit every position reachable from the current one by blocking moves
+    alone, adding the position_key() of each to /visited/, and make each
+    merci possible there, recording it in /candidates/, a dict mapping the
+    position_key() of the position it leads to to a MerciCandidate.
+    Positions reached more than once are only visited (or recorded) the
+    first time. /line/ is the principal variation of the moves made to get
+    here.
+
+    If the context's /por/ is set, /sleep/ maps the move_key() of each
+    merci that needn't be made here to its Footprint, as for
+    search_position(): these were made at an earlier position and commute
+    with every move made since, so the position after the merci is reached
+    in the search after that earlier one.
+
+    Return the largest foundation count of a position with no blocking
+    moves left, visited or reached by a merci, and the principal variation
+    reaching it. Once that reaches the context's target, nothing better is
+    possible, and the search stops.
+    """
+    visited.add(position_key(tableau, foundation, False))
+    best_count, best_line = -1, None
+    packed = None
+    log = ctx.log
+    if sleep is None:
+        sleep = {}
+    made = {}
+    for merci in tableau.merci_moves(foundation):
+        merci_key = move_key(merci)
+        if merci_key in sleep:
+            continue
+        mark = log.mark()
+        stack_mark = len(move_stack)
+        make_move(tableau, foundation, move_stack, merci, log, ctx.stats)
+        if ctx.por:
+            made[merci_key] = footprint(log, mark, merci)
+        key = position_key(tableau, foundation, False)
+        count = len(foundation)
+        is_new = key not in candidates
+        if is_new and not tableau.moves(False, foundation):
+            # Nothing left to search after this merci.
+            ctx.improve(count)
+            if count > best_count:
+                best_count, best_line = count, line + bytes((merci_key,))
+        log.undo(mark)
+        del move_stack[stack_mark:]
+        if is_new:
+            if packed is None:
+                packed = pack(tableau, foundation)
+            candidates[key] = MerciCandidate(count, reclvl + 1, packed,
+                                             line + bytes((merci_key,)), merci)
+    made.update(sleep)
+
+    legal_moves = tableau.moves(False, foundation)
+    if not legal_moves and len(foundation) > best_count:
+        ctx.improve(len(foundation))
+        return len(foundation), line
+
+    for move in order_moves(tableau, foundation, legal_moves):
+        if ctx.finished or ctx.stopped:
+            break
+        count_move(ctx, reclvl)
+        mark = log.mark()
+        stack_mark = len(move_stack)
+        make_move(tableau, foundation, move_stack, move, log, ctx.stats)
+        if position_key(tableau, foundation, False) not in visited:
+            child_sleep = None
+            if ctx.por:
+                move_footprint = footprint(log, mark, move)
+                child_sleep = {key: fp for key, fp in made.items()
+                               if independent(fp, move_footprint)}
+            count, child_line = collect_mercis(tableau, foundation, move_stack, reclvl + 1, ctx,
+                                               visited, candidates,
+                                               line + bytes((move_key(move),)), child_sleep)
+            if count > best_count:
+                best_count, best_line = count, child_line
+        log.undo(mark)
+        del move_stack[stack_mark:]
+    if best_line is None:
+        # Stopped, or every move leads somewhere already visited.
+        return len(foundation), line
+    return best_count, best_line
+
+
+def search_mercis(tableau, foundation, move_stack, reclvl, ctx: SearchContext,
+                  pool=None, table: Optional[TranspositionTable] = None) -> Result:
+    """
+    Search for the best line from the current position when one merci is
+    allowed, as described in recursive_hypothetical().
+
+    Trying a merci at every node would multiply the branching factor, and
+    leave foundation_bound() nothing to prune with until the merci was made.
+    Instead, every position reachable without a merci is visited once, and
+    the position each merci from one of them leads to is collected (see
+    collect_mercis()). Since playing on never takes a card off the
+    foundation, the best line with a merci ends the search from one of
+    these, and the best position visited is the line to beat. The positions
+    after the mercis are then searched without a merci, those with the most
+    cards on the foundation first. Any that can be reached without a merci
+    are skipped, being no better than a position already visited, and as
+    usual, a search whose foundation_bound() can't beat the best line found
+    so far stops at once. The searches share the transposition table,
+    or are handed out to the workers of the SearchPool /pool/ if provided,
+    whose hit/miss counters are added to /table/.
+
+    If the context has /stats/, the foundation count, legal permutations
+    and time of each merci searched are added to its /mercis/.
+    """
+    visited: set = set()
+    candidates: dict = {}
+    best_count, best_line = collect_mercis(tableau, foundation, move_stack, reclvl, ctx,
+                                           visited, candidates)
+    if ctx.finished:
+        return best_count, best_line, best_count
+    if ctx.stopped:
+        return best_count, best_line, foundation_bound(tableau, foundation, True)
+
+    # The mercis reaching the most foundation cards are most likely to lead
+    # to a good line, making the rest easier to cut off.
+    queue = sorted((candidate for key, candidate in candidates.items() if key not in visited),
+                   key=lambda candidate: -candidate.foundation_count)
+    stats = ctx.stats
+    if stats is not None:
+        stats.merci_candidates += len(candidates)
+    if ctx.verbose:
+        print(f"\r  Found {len(candidates)} merci(s) from {len(visited)} position(s) "
+              f"to beat {best_count} card(s) on the foundation.")
+
+    # Each result is (index, (count, line, bound), (nodes, seconds)).
+    if pool is None:
+        def search(index: int, candidate: MerciCandidate):
+            nodes, start = ctx.num_moves.value, time.perf_counter()
+            result = search_position(*candidate.position(), [], False, candidate.depth, ctx)
+            return index, result, (ctx.num_moves.value - nodes, time.perf_counter() - start)
+
+        results = (search(index, candidate) for index, candidate in enumerate(queue))
     else:
+        tasks = ((index, pack(*candidate.position()), candidate.line, False, ctx.target,
+                  ctx.verbose, ctx.deadline, ctx.max_nodes, ctx.por, candidate.depth,
+                  stats is not None)
+                 for index, candidate in enumerate(queue))
+        results = _merci_task_results(pool, tasks, table, stats)
+
+    # The first of several equally good lines wins, in the order of the queue.
+    best_rank = (best_count, 1)
+    bound = best_count
+    for index, (count, line, candidate_bound), (nodes, seconds) in results:
+        candidate = queue[index]
+        if line is not None and (count, -index) > best_rank:
+            best_rank, best_line = (count, -index), candidate.line + line
+        bound = max(bound, candidate_bound)
+        if stats is not None and nodes:
+            stats.mercis.append([candidate.merci.notation(), candidate.depth,
+                                 count if line is not None else None, nodes, seconds])
+        if pool is None and (ctx.finished or ctx.stopped):
+            if not ctx.finished and index + 1 < len(queue):
+                # The mercis left unsearched might have done better.
+                bound = max(bound, foundation_bound(tableau, foundation, True))
+            break
+    return best_rank[0], best_line, bound
+
+
+def _merci_task_results(pool, tasks: Iterable[tuple], table: Optional[TranspositionTable],
+                        stats: Optional[SearchStats]) -> Iterable[tuple]:
+    """
+    Run search_mercis()' /tasks/ on /pool/, adding the workers' counters to
+    /table/ and /stats/ (if provided), and yield each task's index, result,
+    and the nodes it searched and seconds it took (if known).
+    """
+    for index, result, counters, task_stats in pool.imap_unordered(_search_task, tasks,
+                                                                    window=4 * pool.jobs):
+        if table is not None:
+            table.add_counters(counters)
+        effort = (0, 0.0)
+        if task_stats is not None:
+            stats.merge(task_stats)
+            effort = task_stats.nodes, next(iter(task_stats.workers.values()))[1]
+        yield index, result, effort
+
+
+def recursive_hypothetical(tableau, foundation, move_stack, merci=False, num_moves=None,
+                           reclvl=0, table=None, pool=None, split_depth=2, verbose=True,
+                           time_limit=None, max_nodes=None, stop=None, por=True,
+                           stats=None, abort=None):
+    """
+    Perform a complete tree search for the best possible series of blocking
+    moves. Between each blocking move, all automatic moves are applied. The
+    "best" series of blocking moves is the one that ends (reaches a state
+    with no more legal moves) with the largest number of cards on the
+    foundation. (Nothing else matters because we reshuffle the tableau once
+    we reach that end state anyway.)
+
+    The search is a branch-and-bound: subtrees that provably can't beat the
+    best line already found are skipped, and the search stops as soon as it
+    finds a line reaching the upper bound for the starting position (e.g.,
+    a complete solution). The most promising moves are tried first (see
+    order_moves()), and, unless /por/ is False, moves that commute are only
+    tried in one order (see search_position()).
+
+    The search is also an anytime search: if it runs for /time_limit/
+    seconds, searches /max_nodes/ legal permutations, or the shared flag
+    /stop/ is set (the pool's flag, if using a pool), it stops and returns
+    the best line found so far. Without a pool, it also stops when /abort/
+    is set (see SearchContext).
+
+    Moves are made and undone in place as the search proceeds, so the
+    tableau, foundation and move stack passed in are unchanged on return.
+    The search keeps only the principal variation of the best line (see
+    Result); the line is replayed once at the end, and the final tableau,
+    foundation and move stack are returned as new objects, as (foundation
+    count, (tableau, foundation, move stack), optimal), where /optimal/ is
+    True if the line is proven to be the best possible (which it always is
+    unless the search was stopped).
+
+    If /merci/ is set, one merci is allowed, and the search for it is
+    factored out of the search for blocking moves (see search_mercis()).
+
+    If a SearchPool is provided as /pool/, the tree is split into subtrees
+    at /split_depth/ blocking moves, which are handed out to the pool's
+    workers as they become idle; each worker uses its own transposition
+    table, and the hit/miss counters are added to /table/ if provided.
+    Otherwise the whole search runs in this process, using the
+    TranspositionTable /table/ (if provided) to avoid searching positions
+    again when they're reached by a different order of moves.
+
+    Progress is printed as the search goes, unless /verbose/ is False. If a
+    SearchStats object is provided as /stats/, the search's counters
+    (including those of the pool's workers) are added to it.
+    """
+    if num_moves is None:
         num_moves = Value('i', 0)
-        _, state = recursive_hypothetical(tableau, found, move_stack, merci, num_moves)
-        print(f"\r  Found {num_moves.value} total legal permutation(s) "
-              f"of blocking moves.   ", end='')
-        if state is None:
-            pass  # there were no legal moves at all
+    if not tableau.moves(merci, foundation):
+        return len(foundation), final_position(tableau, foundation, move_stack, merci, b'',
+                                               stats), True
+
+    target = foundation_bound(tableau, foundation, merci)
+    deadline = time.monotonic() + time_limit if time_limit is not None else None
+    if pool is None:
+        ctx = SearchContext(num_moves, table, target, verbose=verbose, stop=stop,
+                            deadline=deadline, max_nodes=max_nodes, por=por, stats=stats,
+                            abort=abort)
+        start, nodes = time.perf_counter(), num_moves.value
+        if merci:
+            count, line, bound = search_mercis(tableau, foundation, move_stack, reclvl, ctx)
         else:
-            tableau, found, move_stack = state
-    
-    # Figure out where to stop listing moves, seeing as any moves after
-    # the final foundation move are pointless.
-    last_foundation = -1
-    for idx, move in enumerate(move_stack):
+            count, line, bound = search_position(tableau, foundation, move_stack, merci, reclvl,
+                                                 ctx)
+        if stats is not None:
+            stats.add_worker(f"pid {os.getpid()}", num_moves.value - nodes, time.perf_counter() - start,
+                             peak_rss())
+        return count, final_position(tableau, foundation, move_stack, merci, line, stats), \
+            bound <= count
+
+    pool.reset()
+    ctx = SearchContext(pool.num_moves, None, target, pool.incumbent, verbose,
+                        pool.stop, deadline, max_nodes, por, stats)
+    if merci:
+        if verbose:
+            print(f"DFS for the best merci on {pool.jobs} process(es):")
+        count, line, bound = search_mercis(tableau, foundation, move_stack, reclvl, ctx,
+                                           pool, table)
+        num_moves.value = pool.num_moves.value
+        return count, final_position(tableau, foundation, move_stack, merci, line, stats), \
+            bound <= count
+
+    tasks = {}
+    split_tree(tableau, foundation, move_stack, merci,
+               0 if pool.is_serial else split_depth, ctx, tasks, reclvl)
+    if verbose:
+        print(f"DFS for best blocking moves using {len(tasks)} subtree(s) "
+              f"on {pool.jobs} process(es):")
+
+    # The first of several equally good lines wins, in the order split_tree()
+    # found them, regardless of which finishes first.
+    task_list = list(tasks.values())
+    best_rank, best_line = (-1, 0), None
+    bound = -1
+    for index, (count, line, task_bound), counters, task_stats in pool.imap_unordered(
+            _search_task, task_list):
+        if table is not None:
+            table.add_counters(counters)
+        if task_stats is not None:
+            stats.merge(task_stats)
+        if line is not None and (count, -index) > best_rank:
+            best_rank, best_line = (count, -index), task_list[index][2] + line
+        bound = max(bound, task_bound)
+    num_moves.value = pool.num_moves.value
+
+    count = best_rank[0]
+    return count, final_position(tableau, foundation, move_stack, merci, best_line, stats), \
+        bound <= count
+
+
+def final_position(tableau, foundation, move_stack, merci: bool, line: bytes,
+                   stats: Optional[SearchStats] = None) -> Tuple[Tableau, Foundations, List[Move]]:
+    """
+    Replay the principal variation /line/ found by the search from the
+    position it started from, and return the final tableau, foundation and
+    move stack (the moves in /move_stack/ followed by those of the line).
+    """
+    start = time.perf_counter()
+    replayed = replay_line(tableau, foundation, merci, line)
+    assert replayed is not None, "the search's best line must replay"
+    final_tableau, final_foundation, moves = replayed
+    if stats is not None:
+        stats.add_time('replay', start)
+    return final_tableau, final_foundation, move_stack + moves
+
+
+class DealResult:
+    """
+    The outcome of solving one deal: the best line of moves found, the
+    tableau and foundation at the end of it, and what it cost to find.
+    /optimal/ is False if the search was stopped (by a limit or by Ctrl-C,
+    in which case /interrupted/ is set) before proving there is no better line.
+    /stats/ holds the search's SearchStats, if they were asked for.
+    /initial_count/ is the number of cards on the foundation when the deal began.
+    /cached/ is True if the line was found in a SolutionCache rather than searched for.
+    /start/ is the position the deal began from, packed by state.pack().
+    /redeal_estimates/ is set if the line was chosen among several by
+    sampling redeals (see redeal.EndStateChooser).
+    """
+    def __init__(self, deal: int, moves: List[Move], tableau: Tableau,
+                 foundation: Foundations, num_moves: int, elapsed: float,
+                 table: Optional[TranspositionTable] = None, optimal: bool = True,
+                 interrupted: bool = False, stats: Optional[SearchStats] = None,
+                 initial_count: int = 0, cached: bool = False,
+                 start: Optional[bytes] = None) -> None:
+        self.deal = deal
+        self.moves = moves
+        self.tableau = tableau
+        self.foundation = foundation
+        self.num_moves = num_moves
+        self.elapsed = elapsed
+        self.table = table
+        self.optimal = optimal
+        self.interrupted = interrupted
+        self.stats = stats
+        self.initial_count = initial_count
+        self.cached = cached
+        self.start = start
+        self.redeal_estimates: Optional[list] = None
+
+    @property
+    def solved(self) -> bool:
+        "Whether this deal finished the game."
+        return not self.tableau
+
+    @property
+    def cards_played(self) -> int:
+        "The number of cards this deal moved to the foundation."
+        return len(self.foundation) - self.initial_count
+
+    @property
+    def useful_moves(self) -> List[Move]:
+        """
+        The moves of the best line up to its final foundation move; any moves
+        after that are pointless.
+        """
+        last_foundation = -1
+        for idx, move in enumerate(self.moves):
+            if move.is_foundation_move:
+                last_foundation = idx
+        return self.moves[:last_foundation+1]
+
+    def stats_record(self) -> dict:
+        """
+        Summarize what the search for this deal cost as a JSON-serializable
+        dict, including its SearchStats if there are any.
+        """
+        record = {
+            'deal': self.deal,
+            'foundation': len(self.foundation),
+            'optimal': self.optimal,
+            'interrupted': self.interrupted,
+            'cached': self.cached,
+            'nodes': self.num_moves,
+            'time': round(self.elapsed, 6),
+            'nodes_per_sec': round(self.num_moves / self.elapsed, 1) if self.elapsed else None,
+        }
+        if self.table is not None:
+            record['table'] = dict(zip(('hits', 'misses', 'evictions'), self.table.counters()))
+        if self.stats is not None:
+            record.update(self.stats.to_dict())
+        if self.redeal_estimates is not None:
+            record['redeal_estimates'] = [estimate.to_dict()
+                                          for estimate in self.redeal_estimates]
+        return record
+
+
+class GameResult:
+    "The outcome of solving a game: the result of each deal played."
+    def __init__(self, deals: List[DealResult], elapsed: float) -> None:
+        self.deals = deals
+        self.elapsed = elapsed
+
+    @property
+    def solved(self) -> bool:
+        return bool(self.deals) and self.deals[-1].solved
+
+    @property
+    def optimal(self) -> bool:
+        "Whether every deal's line was proven to be the best possible."
+        return all(deal.optimal for deal in self.deals)
+
+    @property
+    def interrupted(self) -> bool:
+        return any(deal.interrupted for deal in self.deals)
+
+    @property
+    def foundation_count(self) -> int:
+        "The number of cards on the foundation at the end of the game."
+        return len(self.deals[-1].foundation)
+
+
+def replay_line(tableau, foundation, merci: bool,
+                line: Iterable[int]) -> Optional[Tuple[Tableau, Foundations, List[Move]]]:
+    """
+    Make the blocking moves and mercis in /line/, given as move_key()s
+    (e.g., a principal variation), on a copy of the position, each followed
+    by its automatic moves. Return the final tableau and foundation and all
+    the moves made, or None if a move in the line isn't legal.
+
+    The line needn't end with no legal moves left: a line with a merci
+    allowed can end once no merci would help (see search_mercis()).
+    """
+    tableau, foundation = unpack(pack(tableau, foundation))
+    move_stack: List[Move] = []
+    log = ChangeLog()
+    for key in line:
+        move = next((m for m in tableau.moves(merci, foundation) if move_key(m) == key), None)
+        if move is None:
+            return None
+        make_move(tableau, foundation, move_stack, move, log)
+        merci = merci and not move.is_merci
+    return tableau, foundation, move_stack
+
+
+def describe_moves(tableau, foundation, moves: Iterable[Move]) -> None:
+    """
+    Make /moves/, a complete record of the moves made from a position, on
+    /tableau/ and /foundation/ (which are changed), having each describe()
+    the fan it goes onto first. Only the moves that are reported need this,
+    so the search doesn't.
+    """
+    for move in moves:
+        move.describe(tableau)
+        card = tableau.fan_of(move.card).pop(move.card)
         if move.is_foundation_move:
-            last_foundation = idx
+            foundation.insert(card)
+        else:
+            tableau.index.wanted_by[card.id].push(card)
 
-    print("")
-    if not move_stack[:last_foundation+1]:
-        print("Darn! No legal moves from this position would allow a foundation move.")
-    else:
-        print(f"Best sequence has {last_foundation+1} moves, "
-              f"transferring {orig_tableau_length - len(tableau)} cards to the foundation "
-              f"and leaving {len(tableau)} on the tableau.")
-        print("")
-        print("Move sequence:")
-        for move in move_stack[:last_foundation+1]:
-            print("  " + str(move))
-        if last_foundation + 1 < len(move_stack):
-            print(f"  ({len(move_stack) - last_foundation - 1} further legal "
-                  f"move(s) omitted "
-                  f"because they do not enable any further foundation moves)")
-
-    print("")
-    print(f"Final table state after deal {deal}:")
-    print(tableau)
-    print("")
-    print(found)
-
-    return tableau, found
+
+def end_states(tableau, foundation, limit: int, max_nodes: Optional[int] = None,
+               deadline: Optional[float] = None, stop=None) -> List[Tuple[int, bytes]]:
+    """
+    Find the /limit/ end states of this deal (positions with no blocking
+    moves left, without a merci) with the most cards on the foundation,
+    counting end states with the same foundation only once, since the same
+    cards are gathered and redealt from them. Return the foundation count
+    and the principal variation reaching each, best first; ties go to the
+    end state found first.
+
+    Every position reachable by blocking moves is visited once, except
+    where foundation_bound() shows nothing below it could make the list.
+    If /max_nodes/ is set, the search stops after that many positions; it
+    also stops when time.monotonic() passes /deadline/, or when the shared
+    flag /stop/ is set (e.g., by StopOnInterrupt), returning the end states
+    found so far.
+    """
+    tableau, foundation = unpack(pack(tableau, foundation))
+    found: Dict[tuple, Tuple[int, bytes]] = {}
+    visited = {position_key(tableau, foundation, False)}
+    log = ChangeLog()
+    move_stack: List[Move] = []
+
+    def out_of_budget() -> bool:
+        return ((max_nodes is not None and len(visited) >= max_nodes)
+                or (deadline is not None and time.monotonic() >= deadline)
+                or (stop is not None and bool(stop.value)))
+
+    def visit(line: bytes) -> None:
+        if len(found) >= limit:
+            worst = min(count for count, _ in found.values())
+            if foundation_bound(tableau, foundation) <= worst:
+                return
+        legal_moves = tableau.moves(False, foundation)
+        if not legal_moves:
+            key = foundation.key()
+            if key not in found:
+                found[key] = (len(foundation), line)
+                if len(found) > limit:
+                    # Drop the worst; of equals, the one found last.
+                    del found[min(reversed(found), key=lambda k: found[k][0])]
+            return
+        for move in order_moves(tableau, foundation, legal_moves):
+            if out_of_budget():
+                return
+            mark = log.mark()
+            stack_mark = len(move_stack)
+            make_move(tableau, foundation, move_stack, move, log)
+            key = position_key(tableau, foundation, False)
+            if key not in visited:
+                visited.add(key)
+                visit(line + bytes((move_key(move),)))
+            log.undo(mark)
+            del move_stack[stack_mark:]
+
+    visit(b'')
+    return sorted(found.values(), key=lambda entry: -entry[0])
+
+
+def deal_endings(result: DealResult, limit: int, max_nodes: Optional[int] = None,
+                 deadline: Optional[float] = None, stop=None) -> List[DealResult]:
+    """
+    Return /result/ and up to /limit/ - 1 other DealResults for the same
+    deal, each ending with a different foundation, found by end_states()
+    (which see, also for /max_nodes/, /deadline/ and /stop/) from the
+    position the deal began from. The others share /result/'s search costs.
+    """
+    endings = [result]
+    if result.start is None or limit < 2:
+        return endings
+    tableau, found = unpack(result.start)
+    automatic: List[Move] = []
+    run_automatic_actions(tableau, found, automatic)
+    for _, line in end_states(tableau, found, limit, max_nodes, deadline, stop):
+        if len(endings) >= limit:
+            break
+        end_tableau, end_found, moves = replay_line(tableau, found, False, line)
+        if end_found.key() == result.foundation.key():
+            continue
+        moves = automatic + moves
+        describe_moves(*unpack(result.start), moves)
+        endings.append(DealResult(result.deal, moves, end_tableau, end_found,
+                                  result.num_moves, result.elapsed, result.table,
+                                  result.optimal, result.interrupted, result.stats,
+                                  result.initial_count, result.cached, result.start))
+    return endings
+
+
+def solve_deal(tableau, found, deal=1, merci=False, table=None, pool=None, split_depth=2,
+               verbose=False, time_limit=None, max_nodes=None, por=True,
+               stats=False, cache=None, handle_interrupt=True, abort=None) -> DealResult:
+    """
+    Find the best line of moves for one deal, starting with all the
+    automatic moves and then searching for the best series of blocking
+    moves with recursive_hypothetical() (which see for the other
+    arguments). The automatic moves are made on /tableau/ and /found/
+    themselves.
+
+    If Ctrl-C is pressed during the search, the search stops and the best
+    line found so far is returned, with the result marked as interrupted.
+    If /handle_interrupt/ is False, SIGINT is left alone instead, so Ctrl-C
+    raises KeyboardInterrupt (or does whatever else the program set up).
+
+    If /stats/ is set, the result's /stats/ holds SearchStats for the deal.
+
+    If a SolutionCache is provided as /cache/, the best line is looked up
+    there (and replayed) instead of searched for if the position after the
+    automatic moves has been solved before; otherwise, the line found is
+    stored there if the search proved it to be the best possible.
+    """
+    watch = Stopwatch()
+    initial_count = len(found)
+    start = pack(tableau, found)
+    move_stack = []
+    run_automatic_actions(tableau, found, move_stack)
+    search_stats = SearchStats() if stats else None
+    if search_stats is not None:
+        search_stats.automatic_moves += len(move_stack)
+
+    num_moves = Value('i', 0)
+    optimal = True
+    cached = False
+    if cache is not None and len(found) < 52:
+        cache_key, perm = cache.key(tableau, found, merci)
+        hit = cache.lookup(cache_key, perm)
+        replayed = replay_line(tableau, found, merci, hit[1]) if hit is not None else None
+        if replayed is not None and len(replayed[1]) == hit[0]:
+            tableau, found, line = replayed
+            move_stack += line
+            cached = True
+
+    stop = pool.stop if pool is not None else Value('b', 0)
+    with StopOnInterrupt(stop, handle_interrupt) as interrupt:
+        if len(found) < 52 and not cached:
+            if pool is not None:
+                # The workers have the real tables; this one just tallies their counters.
+                table = TranspositionTable(max_size=0) if pool.table_size > 0 else None
+            _, (tableau, found, move_stack), optimal = recursive_hypothetical(
+                tableau, found, move_stack, merci, num_moves, table=table, pool=pool,
+                split_depth=split_depth, verbose=verbose, time_limit=time_limit,
+                max_nodes=max_nodes, stop=stop, por=por, stats=search_stats, abort=abort)
+            if cache is not None and optimal:
+                cache.store(cache_key, perm, len(found), move_stack)
+
+    describe_moves(*unpack(start), move_stack)
+    watch.checkpoint()
+    if search_stats is not None:
+        search_stats.peak_rss = peak_rss()
+    return DealResult(deal, move_stack, tableau, found, num_moves.value,
+                      watch.running_time, table, optimal, interrupt.interrupted, search_stats,
+                      initial_count, cached, start)
+
+
+def solve_game(tableau, found, first_deal=1, max_deal=3, redeal=False, merci=False,
+               rng: Union[random.Random, Shuffler, None] = None,
+               before_deal: Optional[Callable[[int, Tableau, Foundations], None]] = None,
+               after_deal: Optional[Callable[[DealResult], None]] = None,
+               choose_ending: Optional[Callable[[DealResult], DealResult]] = None,
+               **search_options) -> GameResult:
+    """
+    Solve a game from the given position, which is on deal /first_deal/:
+    solve that deal and, if /redeal/ is set and the game isn't won, gather,
+    shuffle (with /rng/, a random number generator or Shuffler, if
+    provided) and redeal the remaining cards and solve the next deal, up to
+    /max_deal/. A merci is allowed on the final
+    deal if /merci/ is set. /search_options/ are passed on to solve_deal().
+    If a deal's search is interrupted with Ctrl-C, no more deals are played.
+
+    Nothing is printed (unless the search is verbose). To follow the game
+    as it goes, pass /before_deal/, called with the deal number, tableau
+    and foundation before each deal is searched, and /after_deal/, called
+    with each deal's DealResult.
+
+    By default, each deal ends with the most cards on the foundation
+    possible. If /choose_ending/ is provided, it is called with the result
+    of each deal but the last (unless the game was won or interrupted) and
+    returns the DealResult to continue from instead (e.g., one chosen by a
+    redeal.EndStateChooser).
+    """
+    watch = Stopwatch()
+    deck = Deck()
+    last_deal = max_deal if redeal else first_deal
+    deals = []
+    for deal_num in range(first_deal, last_deal+1):
+        if deals:
+            # Redeal a copy, so the last deal's result keeps its final position.
+            tableau, found = unpack(pack(tableau, found))
+            deck.add_many(tableau.gather())
+            deck.shuffle(rng)
+            tableau.deal(deck)
+        if before_deal is not None:
+            before_deal(deal_num, tableau, found)
+        result = solve_deal(tableau, found, deal_num,
+                            merci=merci and deal_num == last_deal, **search_options)
+        if (choose_ending is not None and deal_num < last_deal
+                and not result.solved and not result.interrupted):
+            result = choose_ending(result)
+        deals.append(result)
+        if after_deal is not None:
+            after_deal(result)
+        tableau, found = result.tableau, result.foundation
+        if result.solved or result.interrupted:
+            break
+
+    watch.checkpoint()
+    return GameResult(deals, watch.running_time)
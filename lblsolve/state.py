@@ -0,0 +1,112 @@
+import itertools
+from typing import Tuple
+
+from .card import CARDS
+from .lucie import Fan, Foundations, Tableau
+
+NUM_SUITS = 4
+
+# Every way of relabeling the suits: each gives the new index of each suit
+# (in the order of SUITS), and a bytes.translate() table mapping each card
+# id to the id it becomes.
+SUIT_PERMUTATIONS = tuple(itertools.permutations(range(NUM_SUITS)))
+RELABELED_IDS = {perm: bytes(perm[i // 13] * 13 + i % 13 if i < len(CARDS) else i
+                             for i in range(256))
+                 for perm in SUIT_PERMUTATIONS}
+
+
+def pack(tableau: Tableau, foundation: Foundations) -> bytes:
+    """
+    Encode a tableau and foundation as a packed position: a bytes object
+    holding the height of each foundation pile (in the order of SUITS),
+    followed by each fan as its length and then the ids of its cards from
+    bottom to top.
+
+    A full game fits in well under 100 bytes, so packed positions are cheap
+    to hash, compare, send between processes, and store on disk.
+    """
+    data = bytearray(foundation.key())
+    for fan in tableau.fans:
+        data.append(len(fan))
+        data.extend(c.id for c in fan)
+    return bytes(data)
+
+
+def canonical(tableau: Tableau, foundation: Foundations) -> bytes:
+    """
+    Encode a tableau and foundation as a packed position with the fans
+    sorted, so that positions differing only in the order of their fans
+    have the same encoding.
+    """
+    fans = sorted(bytes([len(fan.cards), *[c.id for c in fan.cards]]) for fan in tableau.fans)
+    return bytes(foundation.key()) + b''.join(fans)
+
+
+def symmetric_canonical(tableau: Tableau,
+                        foundation: Foundations) -> Tuple[bytes, Tuple[int, ...]]:
+    """
+    Like canonical(), but with the suits relabeled too: the rules treat
+    every suit alike, so positions differing only in the order of their fans
+    and the names of their suits have the same encoding. Return the encoding
+    and the relabeling that produces it, a tuple giving the new index of
+    each suit (in the order of SUITS).
+    """
+    heights = foundation.key()
+    fans = [bytes(c.id for c in fan) for fan in tableau.fans]
+    best = None
+    for perm in SUIT_PERMUTATIONS:
+        relabeled_heights = [0] * NUM_SUITS
+        for suit_idx, height in enumerate(heights):
+            relabeled_heights[perm[suit_idx]] = height
+        table = RELABELED_IDS[perm]
+        encoding = bytes(relabeled_heights) + b''.join(
+            sorted(bytes([len(fan)]) + fan.translate(table) for fan in fans))
+        if best is None or encoding < best[0]:
+            best = encoding, perm
+    return best
+
+
+def unpack(data: bytes) -> Tuple[Tableau, Foundations]:
+    """
+    Decode a packed position into a new tableau and foundation.
+    Raise ValueError if /data/ is not a valid packed position: between them,
+    the foundation and the fans (none of them empty) must hold every card
+    exactly once.
+    """
+    if len(data) < NUM_SUITS or any(h > 13 for h in data[:NUM_SUITS]):
+        raise ValueError("Packed position has an invalid foundation.")
+    found = Foundations.from_heights(data[:NUM_SUITS])
+    placed = [False] * len(CARDS)
+    for suit_idx, height in enumerate(data[:NUM_SUITS]):
+        placed[suit_idx * 13:suit_idx * 13 + height] = [True] * height
+
+    tableau = Tableau()
+    idx = NUM_SUITS
+    while idx < len(data):
+        length = data[idx]
+        ids = data[idx+1:idx+1+length]
+        if not length or len(ids) != length or any(i >= len(CARDS) for i in ids):
+            raise ValueError("Packed position has an invalid fan.")
+        for i in ids:
+            if placed[i]:
+                where = ("on both the foundation and the tableau"
+                         if i % 13 < data[i // 13] else "twice")
+                raise ValueError(f"Packed position has the {CARDS[i]} {where}.")
+            placed[i] = True
+        tableau.add_fan(Fan([CARDS[i] for i in ids]))
+        idx += 1 + length
+    if not all(placed):
+        raise ValueError(f"Packed position is missing the {CARDS[placed.index(False)]}.")
+    return tableau, found
+
+
+def save_position(path: str, tableau: Tableau, foundation: Foundations) -> None:
+    "Write a position to the file at /path/ in packed form."
+    with open(path, 'wb') as f:
+        f.write(pack(tableau, foundation))
+
+
+def load_position(path: str) -> Tuple[Tableau, Foundations]:
+    "Read a position written by save_position()."
+    with open(path, 'rb') as f:
+        return unpack(f.read())
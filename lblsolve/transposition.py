@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from typing import Hashable, NamedTuple, Optional
+
+from .lucie import Foundations, Tableau
+from .state import canonical
+
+DEFAULT_SIZE = 100_000
+EVICTION_POLICIES = ('lru', 'fifo')
+
+
+class Entry(NamedTuple):
+    """
+    The best result the search found beneath a position: the number of cards
+    on the foundation at the end of the best line, and the line's principal
+    variation from the position (see solve.Result).
+    """
+    foundation_count: int
+    line: bytes
+
+
+def position_key(tableau: Tableau, foundation: Foundations, merci: bool) -> Hashable:
+    """
+    Return the key identifying a search position in the transposition table.
+    Whether a merci is still available is part of the position, since it
+    changes which moves are legal.
+    """
+    return canonical(tableau, foundation) + (b'M' if merci else b'')
+
+
+class TranspositionTable:
+    """
+    Remembers the best result reachable from positions the search has
+    already explored.
+
+    Many blocking moves commute (they touch different fans and suits), so
+    the same position is frequently reached by several different orders of
+    moves. Looking each position up here before searching it means each
+    such subtree is searched only once.
+
+    The table holds at most /max_size/ entries. When it is full, storing a
+    new entry evicts the least recently used entry (policy 'lru') or the
+    oldest stored entry (policy 'fifo'). A /max_size/ of 0 disables storage.
+    """
+    def __init__(self, max_size: int = DEFAULT_SIZE, policy: str = 'lru') -> None:
+        assert policy in EVICTION_POLICIES, f"Unknown eviction policy {policy}"
+        self.max_size = max_size
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self) -> str:
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0.0
+        return (f"{self.hits} hit(s), {self.misses} miss(es) ({rate:.1f}% hit rate), "
+                f"{self.evictions} eviction(s)")
+
+    def lookup(self, key: Hashable) -> Optional[Entry]:
+        "Return the entry for /key/, or None if the position is not known."
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self.policy == 'lru':
+            self._entries.move_to_end(key)
+        return entry
+
+    def store(self, key: Hashable, entry: Entry) -> None:
+        "Record the best result found beneath the position identified by /key/."
+        if self.max_size <= 0:
+            return
+        if key not in self._entries and len(self._entries) >= self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        self._entries[key] = entry
+
+    def counters(self) -> tuple:
+        "Return the hit, miss, and eviction counters, e.g., to send to another process."
+        return self.hits, self.misses, self.evictions
+
+    def add_counters(self, counters: tuple) -> None:
+        "Add counters collected by a copy of this table in another process."
+        hits, misses, evictions = counters
+        self.hits += hits
+        self.misses += misses
+        self.evictions += evictions
@@ -17,6 +17,12 @@ setuptools.setup(
     long_description_content_type="text/markdown",
     url="https://github.com/sobjornstad/lblsolve",
     packages=setuptools.find_packages(),
+    package_data={
+        "lblsolve": ["benchmarks/*.jsonl", "benchmarks/*.json"],
+    },
+    extras_require={
+        "numpy": ["numpy"],
+    },
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",